@@ -46,27 +46,30 @@ def check_dependencies():
     if is_frozen():
         return
     
+    from importlib.util import find_spec
+    
     required_packages = [
         ("streamlit", "streamlit"),
         ("google.genai", "google-genai"),
         ("dotenv", "python-dotenv"),
         ("fitz", "pymupdf"),
+        ("tenacity", "tenacity"),
     ]
     
+    # 只查找模块而不导入，避免启动时加载 streamlit / google.genai 等重量级依赖
     missing = []
     for import_name, package_name in required_packages:
         try:
-            __import__(import_name)
+            found = find_spec(import_name) is not None
         except ImportError:
-            missing.append((package_name, import_name))
+            found = False
+        if not found:
+            missing.append(package_name)
     
     if missing:
-        print("Installing missing dependencies...")
-        import subprocess
-        for package_name, _ in missing:
-            print(f"  Installing {package_name}...")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", package_name])
-        print("All dependencies installed!")
+        print(f"Missing dependencies: {', '.join(missing)}")
+        print("Install them with: pip install -r requirements.txt")
+        sys.exit(1)
 
 
 def main():
@@ -244,6 +247,12 @@ Examples:
     parser.add_argument('-c', '--chunk-size', type=int, default=5, help='Pages per chunk')
     parser.add_argument('--no-chunking', dest='use_chunking', default=None, action='store_false')
     parser.add_argument('--force-chunking', dest='use_chunking', default=None, action='store_true')
+    parser.add_argument('-t', '--max-chunk-tokens', type=int, default=None, help='Pack pages into chunks by estimated tokens')
+    parser.add_argument('-j', '--max-concurrency', type=int, default=4, help='Chunks sent to the API concurrently')
+    parser.add_argument('--parallel-pdfs', '--threads', type=int, default=4, help='PDFs converted concurrently in directory mode')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Ignore the local result cache')
+    parser.add_argument('--text-layer', action='store_true',
+                       help='Convert born-digital PDFs locally from their text layer (requires pymupdf4llm)')
     
     args = parser.parse_args()
     
@@ -283,8 +292,8 @@ Examples:
                 sys.exit(1)
             
             output_dir = args.output if args.output else input_path
-            from pathlib import Path
-            pdf_files = list(Path(input_path).glob("*.pdf"))
+            from pdf2md import find_pdf_files
+            pdf_files = find_pdf_files(input_path)
             
             if not pdf_files:
                 print(f"No PDF files found in {input_path}")
@@ -293,16 +302,40 @@ Examples:
             print(f"Found {len(pdf_files)} PDF files")
             print(f"Output directory: {output_dir}")
             
+            # 并发处理多个 PDF，共享同一个并发控制器以遵守 API 限流
+            from concurrent.futures import ThreadPoolExecutor, as_completed
+            from pdf2md import (ConcurrencyController, create_client, group_identical_pdfs,
+                                create_single_file_prompt_cache, delete_prompt_cache,
+                                keep_prompt_cache_alive)
+            controller = ConcurrencyController(c_start=args.max_concurrency)
+            
+            # 所有文件使用相同的提示词，在服务端缓存一次即可
+            client = create_client(api_key, base_url)
+            prompt_cache = create_single_file_prompt_cache(client, model_name, prompt)
+            prompt_cache_name = prompt_cache.name if prompt_cache else None
+            
             success = 0
             failed = 0
             
-            for pdf_file in pdf_files:
-                pdf_path = str(pdf_file)
-                if process_single_pdf(pdf_path, api_key, prompt, base_url, model_name, 
-                                     output_dir, args.stream, chunk_size, use_chunking):
-                    success += 1
-                else:
-                    failed += 1
+            try:
+                with keep_prompt_cache_alive(client, prompt_cache), \
+                        ThreadPoolExecutor(max_workers=max(1, min(args.parallel_pdfs, len(pdf_files)))) as executor:
+                    # 内容相同的文件只转换一次，结果直接复制
+                    futures = {
+                        executor.submit(process_single_pdf, str(group[0]), api_key, prompt, base_url, model_name,
+                                        output_dir, args.stream, chunk_size, use_chunking,
+                                        args.max_concurrency, args.use_cache, args.max_chunk_tokens, controller,
+                                        prompt_cache_name, [str(p) for p in group[1:]],
+                                        use_text_layer=args.text_layer): len(group)
+                        for group in group_identical_pdfs(pdf_files)
+                    }
+                    for future in as_completed(futures):
+                        if future.result():
+                            success += futures[future]
+                        else:
+                            failed += futures[future]
+            finally:
+                delete_prompt_cache(client, prompt_cache)
             
             print(f"\n{'='*50}")
             print(f"Completed! Success: {success}, Failed: {failed}")
@@ -314,27 +347,23 @@ Examples:
                 print(f"Error: File not found: {input_path}")
                 sys.exit(1)
             
-            output_file = args.output if args.output else None
+            from pdf2md import convert_pdf_to_markdown, get_output_filename
+            
+            # 未指定输出时，输出到 PDF 同目录下的同名 .md 文件
+            output_file = args.output if args.output else get_output_filename(input_path)
             
             print(f"Processing: {input_path}")
             print(f"Model: {model_name}")
             
-            from pdf2md import convert_pdf_to_markdown, save_markdown
-            
-            markdown = convert_pdf_to_markdown(
+            # 分块结果直接流式写入输出文件
+            convert_pdf_to_markdown(
                 input_path, api_key, prompt, base_url, model_name,
-                stream=args.stream, chunk_size=chunk_size, use_chunking=use_chunking
+                stream=args.stream, chunk_size=chunk_size, use_chunking=use_chunking,
+                max_concurrency=args.max_concurrency, use_cache=args.use_cache,
+                output_path=output_file, max_tokens_per_chunk=args.max_chunk_tokens,
+                use_text_layer=args.text_layer
             )
-            
-            if output_file:
-                save_markdown(markdown, output_file)
-                print(f"Output saved to: {output_file}")
-            else:
-                # 输出到文件
-                from pathlib import Path
-                output_file = str(Path(input_path).with_suffix('.md'))
-                save_markdown(markdown, output_file)
-                print(f"Output saved to: {output_file}")
+            print(f"Output saved to: {output_file}")
             
             print("Done!")
             
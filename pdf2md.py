@@ -6,49 +6,27 @@ Usage: python pdf2md.py <pdf_file>
 Supports chunking for large PDFs (>100 pages) to handle token limits and 503 errors.
 """
 
+import io
 import os
 import sys
-import base64
+import functools
 import argparse
 import json
 import re
+import shutil
+import time
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-# Try to import google.genai, install if not available
-try:
-    import google.genai as genai
-except ImportError:
-    print("Installing google-genai...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "google-genai"])
-    import google.genai as genai
-
-# Try to import dotenv, install if not available
-try:
-    from dotenv import load_dotenv
-except ImportError:
-    print("Installing python-dotenv...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "python-dotenv"])
-    from dotenv import load_dotenv
-
-# Try to import PyMuPDF (fitz), install if not available
-try:
-    import fitz
-except ImportError:
-    print("Installing PyMuPDF (fitz)...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "pymupdf"])
-    import fitz
-
-# Try to import tenacity, install if not available
-try:
-    from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-except ImportError:
-    print("Installing tenacity...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "tenacity"])
-    from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+# Heavy dependencies (google.genai, fitz, tenacity) are imported where they are
+# used, so `--help` and helper-only imports don't pay for them. Install them with
+# `pip install -r requirements.txt`.
+from dotenv import load_dotenv
 
 # Load .env file
 load_dotenv()
@@ -56,6 +34,73 @@ load_dotenv()
 # Context character limit for chunking
 CONTEXT_CHAR_LIMIT = 500
 
+# Default number of chunks sent to the API concurrently (starting point for AIMD)
+DEFAULT_MAX_CONCURRENCY = 4
+
+# PDFs larger than this are sent by File API reference rather than inline bytes
+INLINE_PDF_LIMIT = 20 * 1024 * 1024
+
+# PDFs larger than this are recompressed before being sent; images above the DPI
+# threshold are downsampled (JPEG quality below), everything else is lossless
+SHRINK_PDF_MIN_BYTES = 5 * 1024 * 1024
+SHRINK_IMAGE_DPI_THRESHOLD = 300
+SHRINK_IMAGE_DPI = 200
+SHRINK_JPEG_QUALITY = 85
+
+# save_markdown writes large outputs in slices of this many characters
+SAVE_SLICE_CHARS = 1 << 20
+
+# Default number of PDFs converted concurrently in directory mode
+DEFAULT_PARALLEL_PDFS = 4
+
+# Upper bound for the adaptive concurrency controller
+MAX_CONCURRENCY_LIMIT = 32
+
+# Target average latency (seconds) for a chunk request before concurrency stops growing
+LATENCY_TARGET = 60.0
+
+# Lifetime of the server-side cache holding the static prompt prefix; while a run
+# still uses the cache, its TTL is extended every PROMPT_CACHE_REFRESH seconds
+PROMPT_CACHE_TTL = "600s"
+PROMPT_CACHE_REFRESH = 240
+
+# Prompt-only caches estimated below this many tokens are not created
+# (the API rejects contents under the model's minimum cacheable size)
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Placeholders filled per chunk; everything before the first one is a static prefix
+PROMPT_PLACEHOLDER_RE = re.compile(r'\{(PREV_CONTEXT|PREVIOUS_CONTEXT|PDF_CONTENT|CURRENT_PDF_CONTENT)\}')
+
+# Local cache of conversion results (override with PDF2MD_CACHE_DIR)
+CACHE_DIR = Path(os.environ.get('PDF2MD_CACHE_DIR') or Path.home() / '.cache' / 'pdf2md')
+
+# Cached results older than this (seconds) are ignored
+CACHE_EXPIRE_SECONDS = 7 * 86400
+
+# Chunk boundary checks used while stitching
+_TABLE_LINE_RE = re.compile(r'\s*\|')          # line is a table row
+_FIRST_LINE_PIPE_RE = re.compile(r'[^\n]*\|')  # first line contains a table pipe
+_SENTENCE_END_CHARS = frozenset('.!?。！？')
+
+# Chunks of PDFs with more pages than this get their own page-range PDF instead of
+# a reference to the whole document (which would exceed per-request page/token limits)
+SPLIT_PDF_MIN_PAGES = 100
+
+# PyMuPDF does not support multithreaded use, and PDFs are converted from several
+# threads (batch mode, web UI): every fitz call in this process holds this lock
+FITZ_LOCK = threading.RLock()
+
+# A text layer is used directly (use_text_layer) only if it averages at least this
+# many characters per page and no page is mostly covered by images
+TEXT_LAYER_MIN_CHARS_PER_PAGE = 200
+TEXT_LAYER_MAX_IMAGE_COVERAGE = 0.3
+
+# Upper bound (seconds) for a server-advertised retry/reset delay
+MAX_SERVER_WAIT = 300.0
+
+# Pause proactively when fewer than this fraction of the request quota remains
+RATE_LIMIT_LOW_WATERMARK = 0.1
+
 
 def load_prompt(prompt_file: str = "prompt_mortgage.md", skip_toc: bool = True) -> str:
     """Load the prompt from prompt file
@@ -66,10 +111,19 @@ def load_prompt(prompt_file: str = "prompt_mortgage.md", skip_toc: bool = True)
                   If False, remove that instruction to include TOC in output.
     """
     prompt_path = Path(prompt_file)
-    if not prompt_path.exists():
+    try:
+        mtime = prompt_path.stat().st_mtime_ns
+    except OSError:
         print(f"Warning: {prompt_file} not found, using default prompt")
         return "Convert the following PDF content to well-formatted Markdown:"
 
+    # The modification time is part of the cache key, so edited prompt files are re-read
+    return _read_prompt(str(prompt_path), mtime, skip_toc)
+
+
+@functools.lru_cache(maxsize=8)
+def _read_prompt(prompt_path: str, mtime: int, skip_toc: bool) -> str:
+    """Read and filter a prompt file (cached per path, modification time and skip_toc)"""
     with open(prompt_path, 'r', encoding='utf-8') as f:
         prompt = f.read().strip()
     
@@ -97,182 +151,638 @@ def load_prompt(prompt_file: str = "prompt_mortgage.md", skip_toc: bool = True)
     return prompt
 
 
-def extract_pdf_pages(pdf_path: str) -> list:
+def _extract_doc_pages(doc, start: int, end: int, include_empty: bool = False) -> list:
+    """Extract text for pages [start, end) of an open fitz.Document"""
+    pages = []
+    for page_num in range(start, end):
+        # Clean up whitespace
+        text = doc[page_num].get_text("text").strip()
+        if text or include_empty:
+            pages.append({
+                'page_num': page_num + 1,  # 1-based for display
+                'text': text
+            })
+    return pages
+
+
+def open_pdf(pdf):
+    """Open a PDF given as a file path or as in-memory bytes"""
+    import fitz
+
+    with FITZ_LOCK:
+        if isinstance(pdf, (bytes, bytearray)):
+            return fitz.open(stream=pdf, filetype='pdf')
+        return fitz.open(pdf)
+
+
+def read_pdf_bytes(pdf) -> bytes:
+    """Return the raw bytes of a PDF given as a file path or as bytes"""
+    if isinstance(pdf, (bytes, bytearray)):
+        return bytes(pdf)
+    return Path(pdf).read_bytes()
+
+
+def shrink_pdf(pdf):
+    """Recompress a large PDF to reduce the bytes sent to the API
+
+    Streams are deflated and unused objects dropped; only images above
+    SHRINK_IMAGE_DPI_THRESHOLD are downsampled, so text stays legible to the model.
+
+    Args:
+        pdf: Path to the PDF file, or its bytes
+
+    Returns:
+        The smaller PDF bytes, or pdf unchanged if it is small or doesn't shrink
+    """
+    size = len(pdf) if isinstance(pdf, (bytes, bytearray)) else os.path.getsize(pdf)
+    if size < SHRINK_PDF_MIN_BYTES:
+        return pdf
+    try:
+        with FITZ_LOCK:
+            doc = open_pdf(pdf)
+            try:
+                # Available in PyMuPDF >= 1.24.11
+                if hasattr(doc, 'rewrite_images'):
+                    doc.rewrite_images(dpi_threshold=SHRINK_IMAGE_DPI_THRESHOLD, dpi_target=SHRINK_IMAGE_DPI,
+                                       quality=SHRINK_JPEG_QUALITY)
+                data = doc.tobytes(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True)
+            finally:
+                doc.close()
+    except Exception as e:
+        print(f"Warning: Could not compress PDF: {e}")
+        return pdf
+    # Not worth switching away from the original for a marginal gain
+    if len(data) > size * 0.9:
+        return pdf
+    print(f"Compressed PDF from {size / 1e6:.1f} MB to {len(data) / 1e6:.1f} MB")
+    return data
+
+
+def extract_page_range(doc, start: int, end: int) -> bytes:
+    """Copy pages [start, end] (0-based, inclusive) of an open document into a new PDF"""
+    import fitz
+
+    with FITZ_LOCK:
+        sub_doc = fitz.open()
+        try:
+            sub_doc.insert_pdf(doc, from_page=start, to_page=end)
+            return sub_doc.tobytes(garbage=3, deflate=True)
+        finally:
+            sub_doc.close()
+
+
+def extract_pdf_pages(pdf_path, include_empty: bool = False, doc=None) -> list:
     """Extract text from each page of the PDF using PyMuPDF
 
+    Pages are extracted sequentially: a process pool costs more to start (each
+    worker re-imports PyMuPDF) than it saves, even for documents of hundreds of pages.
+
+    Layout analysis runs once per page here; callers that need page text more than
+    once (token estimation in plan_chunks, chunk prompts) reuse the returned list.
+
     Args:
-        pdf_path: Path to the PDF file
+        pdf_path: Path to the PDF file, or its bytes
+        include_empty: If True, keep pages without text so that list index == page index
+        doc: Optional already open fitz.Document for pdf_path, reused instead of reopening
 
     Returns:
         List of dictionaries with 'page_num' and 'text' keys
     """
-    pages = []
     try:
-        doc = fitz.open(pdf_path)
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text("text")
-            # Clean up whitespace
-            text = text.strip()
-            if text:
-                pages.append({
-                    'page_num': page_num + 1,  # 1-based for display
-                    'text': text
-                })
-        doc.close()
+        own_doc = doc is None
+        if own_doc:
+            doc = open_pdf(pdf_path)
+        try:
+            with FITZ_LOCK:
+                return _extract_doc_pages(doc, 0, len(doc), include_empty)
+        finally:
+            if own_doc:
+                with FITZ_LOCK:
+                    doc.close()
     except Exception as e:
         print(f"Error extracting PDF pages: {e}")
         raise
-    return pages
 
 
-def stitch_markdown_chunks(chunks: list) -> str:
-    """Stitch together markdown chunks with proper handling of tables and sentences
+def has_usable_text_layer(doc) -> bool:
+    """Check whether a born-digital PDF's own text layer can replace the API
 
-    Args:
-        chunks: List of markdown strings from each chunk
+    Scanned documents have little or no text, and pages dominated by images
+    (figures, scanned inserts) need the model to read them.
+    """
+    import fitz
+
+    with FITZ_LOCK:
+        if len(doc) == 0:
+            return False
+        text_chars = 0
+        for page in doc:
+            page_area = abs(page.rect) or 1
+            image_area = sum(abs(fitz.Rect(info['bbox']) & page.rect) for info in page.get_image_info())
+            if image_area / page_area > TEXT_LAYER_MAX_IMAGE_COVERAGE:
+                return False
+            text_chars += len(page.get_text("text").strip())
+        return text_chars / len(doc) >= TEXT_LAYER_MIN_CHARS_PER_PAGE
+
+
+def text_layer_to_markdown(doc) -> str:
+    """Convert a PDF's text layer to Markdown locally with pymupdf4llm (optional dependency)
 
     Returns:
-        Combined markdown string
+        Markdown string, or None if pymupdf4llm is not installed
     """
-    if not chunks:
-        return ""
+    try:
+        import pymupdf4llm
+    except ImportError:
+        print("Warning: pymupdf4llm is not installed, using the API instead (pip install pymupdf4llm)")
+        return None
+    with FITZ_LOCK:
+        return pymupdf4llm.to_markdown(doc)
+
+
+class MarkdownStitcher:
+    """Incrementally stitch markdown chunks with table and sentence handling
 
-    if len(chunks) == 1:
-        return chunks[0]
+    Each call to add() returns the text to emit for that chunk, so the output can be
+    written out as it is produced. Trailing whitespace is held back until the next
+    chunk (sentence merging removes it), and only the state of the last emitted line
+    is kept, so memory stays O(one chunk) regardless of document size.
+    """
 
-    result = chunks[0]
+    def __init__(self):
+        self._started = False
+        self._emitted = False   # any non-whitespace output so far
+        self._pending = ""      # trailing whitespace not yet emitted
+        self._line_lead = ""    # leading whitespace + first character of the last line
+        self._last_char = ""    # last non-whitespace character emitted
+
+    def _emit(self, text: str) -> str:
+        text = self._pending + text
+        content = text.rstrip()
+        if not content:
+            self._pending = text
+            return ""
+        self._pending = text[len(content):]
+
+        # Track the start of the last line and its final character
+        newline = content.rfind('\n')
+        if newline >= 0:
+            self._line_lead = ""
+            segment = content[newline + 1:]
+        else:
+            segment = content
+        if not self._line_lead.strip():
+            lead = self._line_lead + segment
+            stripped = lead.lstrip()
+            self._line_lead = lead[:len(lead) - len(stripped) + 1]
+        self._last_char = content[-1]
+        self._emitted = True
+        return content
+
+    def add(self, chunk: str) -> str:
+        """Append a chunk and return the text to emit for it"""
+        if not self._started:
+            self._started = True
+            return self._emit(chunk)
 
-    for i in range(1, len(chunks)):
-        chunk = chunks[i]
+        curr_trimmed = chunk.lstrip()
 
         # Check if previous chunk ends with a table (no closing newline properly)
-        # and current chunk might continue it
-        prev_lines = result.rstrip().split('\n')
-        curr_lines = chunk.lstrip().split('\n')
-
-        # If previous chunk ends with table marker (|) and current has content
-        if prev_lines and prev_lines[-1].strip().startswith('|'):
-            # Check if current chunk starts with table continuation
-            if curr_lines and ('|' in curr_lines[0] or curr_lines[0].strip().startswith('|')):
-                # Ensure proper table continuation - add newline if needed
-                if not result.rstrip().endswith('\n'):
-                    result += '\n'
-                elif result.rstrip().endswith('|'):
-                    result += '\n'
+        # and current chunk might continue it (regexes only scan the first line)
+        if self._emitted and _TABLE_LINE_RE.match(self._line_lead) and _FIRST_LINE_PIPE_RE.match(curr_trimmed):
+            # Ensure proper table continuation - add newline
+            self._pending += '\n'
 
         # Sentence merging: if previous doesn't end with sentence-ending punctuation
         # and current starts with lowercase, remove extra newline
-        prev_trimmed = result.rstrip()
-        curr_trimmed = chunk.lstrip()
-
-        if prev_trimmed and curr_trimmed:
-            prev_ends_punctuation = prev_trimmed[-1] in '.!?。！？'
+        if self._emitted and curr_trimmed:
+            prev_ends_punctuation = self._last_char in _SENTENCE_END_CHARS
+            # str.islower() (not a regex class) so non-Latin lowercase letters also merge
             curr_starts_lowercase = curr_trimmed[0].islower() and curr_trimmed[0].isalpha()
 
             # Check if we should merge sentences (no new paragraph)
             if not prev_ends_punctuation and curr_starts_lowercase:
                 # Remove the extra newline between chunks for sentence continuity
-                result = result.rstrip()
-                # Add a space if the last char is not whitespace
-                if result and not result[-1].isspace():
-                    result += ' '
-                result += curr_trimmed
-            else:
-                # Normal paragraph separation
-                result += '\n\n' + curr_trimmed
-        else:
-            result += '\n\n' + chunk
+                self._pending = ""
+                return self._emit(' ' + curr_trimmed)
+            # Normal paragraph separation
+            return self._emit('\n\n' + curr_trimmed)
+        return self._emit('\n\n' + chunk)
+
+    def finish(self) -> str:
+        """Return the remaining held-back text once all chunks are added"""
+        pending, self._pending = self._pending, ""
+        return pending
 
-    return result
+
+def stitch_markdown_chunks(chunks: list) -> str:
+    """Stitch together markdown chunks with proper handling of tables and sentences
+
+    Args:
+        chunks: List of markdown strings from each chunk
+
+    Returns:
+        Combined markdown string
+    """
+    stitcher = MarkdownStitcher()
+    parts = [stitcher.add(chunk) for chunk in chunks]
+    parts.append(stitcher.finish())
+    return ''.join(parts)
 
 
 def is_retryable_error(exception):
     """Check if the error is retryable (503, 429, etc.)"""
     error_str = str(exception).lower()
-    retryable_codes = ['503', '429', 'rate limit', 'service unavailable', 'timeout', 'time out']
+    retryable_codes = ['503', '429', 'rate limit', 'resource_exhausted', 'service unavailable', 'timeout', 'time out']
     return any(code in error_str for code in retryable_codes)
 
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=2, min=2, max=60),
-    retry=retry_if_exception_type(Exception),
-    reraise=True
-)
-def convert_chunk_with_retry(client, model_name: str, pdf_path: str, page_start: int, page_end: int,
-                              prev_context: str, prompt_template: str, config) -> str:
+class ConcurrencyController:
+    """AIMD (additive increase, multiplicative decrease) limit for concurrent API calls
+
+    The limit grows by `alpha` after each successful call while the rolling average
+    latency stays at or below `l_target`, and is multiplied by `beta` whenever the
+    API reports overload (429/503/timeout). Callers wrap each request in `slot()`,
+    which blocks while the number of in-flight requests is at the current limit.
+    """
+
+    def __init__(self, c_start: float = DEFAULT_MAX_CONCURRENCY, c_min: float = 1,
+                 c_max: float = MAX_CONCURRENCY_LIMIT, alpha: float = 0.5, beta: float = 0.5,
+                 l_target: float = LATENCY_TARGET, window: int = 8):
+        self.c_min = c_min
+        self.c_max = c_max
+        self.c_cur = max(c_min, min(c_max, c_start))
+        self.alpha = alpha
+        self.beta = beta
+        self.l_target = l_target
+        self._latencies = deque(maxlen=window)
+        self._active = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current number of permits (integer part of c_cur)"""
+        return max(1, int(self.c_cur))
+
+    @contextmanager
+    def slot(self):
+        """Hold one permit for the duration of an API call"""
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def record(self, latency: float, exc: Exception = None):
+        """Record the outcome of a call and adjust the limit accordingly"""
+        if exc is not None:
+            if is_retryable_error(exc):
+                self.on_error()
+            return
+        with self._cond:
+            self._latencies.append(latency)
+            avg_latency = sum(self._latencies) / len(self._latencies)
+        if avg_latency <= self.l_target:
+            self.on_success()
+
+    def on_success(self):
+        with self._cond:
+            self.c_cur = min(self.c_max, self.c_cur + self.alpha)
+            # More permits may be available now
+            self._cond.notify_all()
+
+    def on_error(self):
+        with self._cond:
+            previous = self.limit
+            self.c_cur = max(self.c_min, self.c_cur * self.beta)
+        if self.limit < previous:
+            print(f"Rate limited, reducing concurrency to {self.limit}")
+
+
+def _get_response_headers(obj) -> dict:
+    """Return lower-cased HTTP headers from a genai response or APIError, if exposed"""
+    for attr in ('response', 'sdk_http_response'):
+        headers = getattr(getattr(obj, attr, None), 'headers', None)
+        if headers:
+            try:
+                return {str(k).lower(): str(v) for k, v in dict(headers).items()}
+            except Exception:
+                continue
+    return {}
+
+
+def _parse_duration(value) -> float:
+    """Parse a header duration such as "30", "1.5s", "250ms", "6m0s" or an HTTP date into seconds"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if parts and ''.join(n + u for n, u in parts) == value.replace(' ', ''):
+        scale = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+
+    try:
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def _rate_limit_delay(headers: dict) -> float:
+    """Delay advertised by rate-limit headers, or None if the headers don't ask for one
+
+    `retry-after` wins; otherwise, when the remaining request quota has dropped below
+    RATE_LIMIT_LOW_WATERMARK of the limit, wait until `x-ratelimit-reset-requests`.
+    """
+    if not headers:
+        return None
+
+    delay = _parse_duration(headers.get('retry-after'))
+    if delay is not None:
+        return min(delay, MAX_SERVER_WAIT)
+
+    try:
+        remaining = float(headers['x-ratelimit-remaining-requests'])
+        limit = float(headers['x-ratelimit-limit-requests'])
+    except (KeyError, ValueError):
+        return None
+    if limit > 0 and remaining < RATE_LIMIT_LOW_WATERMARK * limit:
+        delay = _parse_duration(headers.get('x-ratelimit-reset-requests'))
+        if delay is not None:
+            return min(delay, MAX_SERVER_WAIT)
+    return None
+
+
+def throttle_from_headers(response):
+    """Sleep proactively if a successful response reports a nearly exhausted quota"""
+    delay = _rate_limit_delay(_get_response_headers(response))
+    if delay:
+        print(f"Request quota nearly exhausted, pausing {delay:.1f}s...")
+        time.sleep(delay)
+
+
+def should_retry(exception) -> bool:
+    """Retry everything except client errors (4xx) that a retry can't fix"""
+    code = getattr(exception, 'code', None)
+    if isinstance(code, int) and 400 <= code < 500 and code not in (408, 429):
+        return False
+    return True
+
+
+class wait_from_exception:
+    """tenacity wait strategy: the server-advertised delay, else a fallback strategy
+
+    Honors `retry-after` and the `x-ratelimit-*` headers carried by the failed
+    request's HTTP response; without them, defers to `fallback` (exponential
+    backoff with jitter by default).
+    """
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+
+    def __call__(self, retry_state) -> float:
+        exception = retry_state.outcome.exception() if retry_state.outcome else None
+        delay = _rate_limit_delay(_get_response_headers(exception))
+        if delay is not None:
+            print(f"Server asked to retry after {delay:.1f}s")
+            return delay
+        if self.fallback is None:
+            from tenacity import wait_random_exponential
+            self.fallback = wait_random_exponential(multiplier=2, min=2, max=60)
+        return self.fallback(retry_state)
+
+
+# Shared wait strategy: server hints first, then exponential backoff with jitter
+RETRY_WAIT = wait_from_exception()
+
+
+def with_retry(func):
+    """Retry func up to 3 times using RETRY_WAIT (tenacity is imported on first call)"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from tenacity import Retrying, stop_after_attempt, retry_if_exception
+        retrying = Retrying(
+            stop=stop_after_attempt(3),
+            wait=RETRY_WAIT,
+            retry=retry_if_exception(should_retry),
+            reraise=True
+        )
+        return retrying(func, *args, **kwargs)
+    return wrapper
+
+
+def cache_key(*parts) -> str:
+    """Content-addressed cache key over the given str/bytes parts"""
+    h = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+        # Length prefix keeps ("ab", "c") and ("a", "bc") distinct
+        h.update(f"{len(data)}:".encode())
+        h.update(data)
+    return h.hexdigest()
+
+
+def cache_get(namespace: str, key: str) -> str:
+    """Return cached markdown for key, or None on a miss or expired entry"""
+    path = CACHE_DIR / namespace / f"{key}.md"
+    try:
+        if time.time() - path.stat().st_mtime > CACHE_EXPIRE_SECONDS:
+            path.unlink()
+            return None
+        return path.read_text(encoding='utf-8')
+    except OSError:
+        return None
+
+
+def cache_set(namespace: str, key: str, content: str):
+    """Store markdown for key (atomic write; errors are only reported)"""
+    directory = CACHE_DIR / namespace
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, directory / f"{key}.md")
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Warning: Could not write cache entry: {e}")
+
+
+def clear_cache() -> int:
+    """Delete all locally cached results
+
+    Returns:
+        Number of cache entries removed
+    """
+    removed = 0
+    for path in CACHE_DIR.glob('*/*.md'):
+        try:
+            path.unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def file_sha256(path: str) -> str:
+    """sha256 of a file's contents, read in blocks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_chunk_text(pages_slice: list) -> str:
+    """Join pre-extracted pages into the text sent for one chunk"""
+    return "".join(f"\n--- Page {p['page_num']} ---\n{p['text']}\n" for p in pages_slice if p['text'])
+
+
+@with_retry
+def convert_chunk_with_retry(client, model_name: str, pages_slice: list,
+                              prev_context: str, prompt_template, config,
+                              controller: ConcurrencyController = None, pdf_part=None) -> str:
     """Convert a single chunk of PDF pages with retry logic
 
     Args:
         client: Gemini client
         model_name: Model name
-        pdf_path: Path to PDF file
-        page_start: Starting page number (0-based)
-        page_end: Ending page number (0-based, inclusive)
-        prev_context: Previous chunk's output (last 500 chars)
-        prompt_template: Prompt template with placeholders
+        pages_slice: Pages of this chunk, as returned by extract_pdf_pages
+        prev_context: Context preceding this chunk (last 500 chars)
+        prompt_template: Prompt template with placeholders, or its segments from compile_prompt_template
         config: Generation config
+        controller: Optional ConcurrencyController limiting concurrent API calls
+        pdf_part: Optional shared PDF part (e.g. a File API reference from upload_pdf) attached for visual context
 
     Returns:
         Markdown string for this chunk
     """
     from google.genai import types
 
-    # Extract text for this chunk
-    doc = fitz.open(pdf_path)
-    chunk_text = ""
-    for page_num in range(page_start, min(page_end + 1, len(doc))):
-        page = doc[page_num]
-        page_text = page.get_text("text").strip()
-        if page_text:
-            chunk_text += f"\n--- Page {page_num + 1} ---\n"
-            chunk_text += page_text + "\n"
-    doc.close()
+    # Assemble text for this chunk from the pre-extracted pages
+    chunk_text = build_chunk_text(pages_slice)
 
     if not chunk_text:
         return ""
 
-    # Prepare prompt with placeholders
-    final_prompt = prompt_template.replace('{PREV_CONTEXT}', prev_context or "(No previous context - this is the first chunk)")
-    final_prompt = final_prompt.replace('{PDF_CONTENT}', chunk_text)
-    final_prompt = final_prompt.replace('{PREVIOUS_CONTEXT}', prev_context or "(No previous context - this is the first chunk)")
-    final_prompt = final_prompt.replace('{CURRENT_PDF_CONTENT}', chunk_text)
-
-    # Create PDF part for this chunk
-    # For chunking, we read the PDF file and send specific pages
-    # Since we're sending text, we'll use the text part only
+    # Prepare prompt with placeholders in a single pass over the template segments
+    if isinstance(prompt_template, str):
+        prompt_template = compile_prompt_template(prompt_template)
+    context = prev_context or "(No previous context - this is the first chunk)"
+    values = {
+        'PREV_CONTEXT': context,
+        'PREVIOUS_CONTEXT': context,
+        'PDF_CONTENT': chunk_text,
+        'CURRENT_PDF_CONTENT': chunk_text,
+    }
+    final_prompt = ''.join(values[segment] if i % 2 else segment for i, segment in enumerate(prompt_template))
+
+    # The chunk text is in the prompt; the PDF itself is only attached by reference
+    # (uploaded once per document) so its bytes aren't re-sent with every chunk
     text_part = types.Part.from_text(text=final_prompt)
 
-    # Also include PDF for better context if available
-    pdf_part = None
-    try:
-        with open(pdf_path, 'rb') as f:
-            pdf_data = f.read()
-        # Only include the relevant pages - use a workaround by sending full PDF
-        # The API will handle it, but for chunking we rely more on the text extraction
-        pdf_part = types.Part.from_bytes(data=pdf_data, mime_type='application/pdf')
-    except Exception as e:
-        print(f"Warning: Could not load PDF for chunk: {e}")
-
     # Generate content
     contents = [text_part]
     if pdf_part:
         contents.insert(0, pdf_part)
 
-    response = client.models.generate_content(
-        model=model_name,
-        contents=contents,
-        config=config
-    )
+    # Stream the response so text arrives as it is generated rather than after the
+    # whole chunk is buffered server-side
+    if controller is None:
+        text, last_event = _stream_chunk_text(client, model_name, contents, config)
+    else:
+        with controller.slot():
+            text, last_event = _stream_chunk_text(client, model_name, contents, config, controller)
+
+    # Rate-limit headers are carried by the streamed events. Pause after the permit
+    # is released, so the wait doesn't hold a slot other requests could use
+    if last_event is not None:
+        throttle_from_headers(last_event)
+    return text
+
+
+def _stream_chunk_text(client, model_name: str, contents: list, config,
+                       controller: ConcurrencyController = None) -> tuple:
+    """Run a streaming generate call
+
+    The latency reported to the controller is time to first token, so the limit
+    reacts as soon as the server starts answering instead of after the full response.
+
+    Returns:
+        (concatenated text, last streamed event or None)
+    """
+    parts = []
+    event = None
+    first_token = False
+    t0 = time.monotonic()
+    try:
+        for event in client.models.generate_content_stream(
+            model=model_name,
+            contents=contents,
+            config=config
+        ):
+            if event.text:
+                if not first_token and controller is not None:
+                    controller.record(time.monotonic() - t0)
+                first_token = True
+                parts.append(event.text)
+    except Exception as e:
+        if controller is not None:
+            controller.record(time.monotonic() - t0, e)
+        raise
+    if not first_token and controller is not None:
+        controller.record(time.monotonic() - t0)
+
+    return ''.join(parts), event
+
+
+def find_pdf_files(directory: str) -> list:
+    """List the PDF files directly inside a directory (case-insensitive extension)
+
+    Uses a single os.scandir pass instead of glob pattern matching.
+    """
+    with os.scandir(directory) as entries:
+        return sorted(Path(entry.path) for entry in entries
+                      if entry.name.lower().endswith('.pdf') and entry.is_file())
+
+
+def group_identical_pdfs(pdf_files: list) -> list:
+    """Group PDFs by content hash so identical files are converted only once
 
-    return response.text if response.text else ""
+    Returns:
+        List of groups (lists of paths) in order of first appearance
+    """
+    groups = {}
+    for pdf_file in pdf_files:
+        try:
+            digest = file_sha256(pdf_file)
+        except OSError:
+            # Unreadable files are left on their own to report their error later
+            digest = str(pdf_file)
+        groups.setdefault(digest, []).append(pdf_file)
+    return list(groups.values())
 
 
-def encode_pdf_to_base64(pdf_path: str) -> str:
-    """Encode PDF file to base64"""
-    with open(pdf_path, 'rb') as pdf_file:
-        return base64.b64encode(pdf_file.read()).decode('utf-8')
+def get_batch_output_filename(pdf_path: str, output_dir: str = None) -> str:
+    """Output markdown path for a PDF: in output_dir if given, else next to the PDF"""
+    if output_dir:
+        return str(Path(output_dir, Path(pdf_path).name).with_suffix('.md'))
+    return get_output_filename(pdf_path)
 
 
 def get_output_filename(pdf_path: str) -> str:
@@ -280,18 +790,70 @@ def get_output_filename(pdf_path: str) -> str:
     
     Returns the full path in the same directory as the input PDF file.
     """
-    pdf_dir = Path(pdf_path).parent
-    pdf_name = Path(pdf_path).stem
-    return str(pdf_dir / f"{pdf_name}.md")
+    return str(Path(pdf_path).with_suffix('.md'))
+
+
+@functools.lru_cache(maxsize=8)
+def create_client(api_key: str, base_url: str = None):
+    """Create a Gemini client, optionally for a custom base URL
+
+    Clients are cached per (api_key, base_url), so conversions in the same process
+    reuse one connection pool instead of opening new connections for every file.
+    """
+    import google.genai as genai
+    from google.genai import types
+
+    # Configure client - always use Client, never use configure()
+    if base_url:
+        http_options = types.HttpOptions(baseUrl=base_url)
+        return genai.Client(api_key=api_key, http_options=http_options)
+    return genai.Client(api_key=api_key)
+
+
+@functools.lru_cache(maxsize=4)
+def generation_config(model_name: str):
+    """Generation config for a model, built once and shared
+
+    Callers derive variants with model_copy instead of mutating it.
+    """
+    from google.genai import types
+
+    # Determine config based on model
+    if model_name.startswith('gemini-3'):
+        return types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(thinking_level=types.ThinkingLevel.HIGH)
+        )
+    return types.GenerateContentConfig(
+        thinking_config=types.ThinkingConfig(thinking_budget=1024)
+    )
+
+
+class IncompleteConversionError(RuntimeError):
+    """Some chunks of a chunked conversion failed (raised with allow_partial=False)
+
+    `markdown` holds the stitched result of the chunks that succeeded (None if it
+    was written to output_path).
+    """
+
+    def __init__(self, markdown, failed_chunks: int, total_chunks: int):
+        super().__init__(f"{failed_chunks} of {total_chunks} chunk(s) failed")
+        self.markdown = markdown
+        self.failed_chunks = failed_chunks
+        self.total_chunks = total_chunks
 
 
 def convert_pdf_to_markdown(pdf_path: str, api_key: str, prompt: str = None, base_url: str = None,
                            model_name: str = None, stream: bool = True, chunk_size: int = 1,
-                           use_chunking: bool = False, progress_callback: callable = None) -> str:
+                           use_chunking: bool = False, progress_callback: callable = None,
+                           max_concurrency: int = DEFAULT_MAX_CONCURRENCY, use_cache: bool = True,
+                           output_path: str = None, max_tokens_per_chunk: int = None,
+                           controller: ConcurrencyController = None, prompt_cache_name: str = None,
+                           pdf_bytes: bytes = None, stream_callback: callable = None,
+                           use_text_layer: bool = False, allow_partial: bool = True) -> str:
     """Convert PDF to Markdown using Gemini API
 
     Args:
-        pdf_path: Path to the PDF file
+        pdf_path: Path to the PDF file (may be None if pdf_bytes is given)
         api_key: Gemini API key
         prompt: Custom prompt text
         base_url: Custom base URL
@@ -300,9 +862,30 @@ def convert_pdf_to_markdown(pdf_path: str, api_key: str, prompt: str = None, bas
         chunk_size: Number of pages per chunk (default: 1)
         use_chunking: Enable chunking for large PDFs (default: False)
         progress_callback: Optional callback function(current_chunk, total_chunks, page_start, page_end) for progress updates
+        max_concurrency: Initial number of chunks sent to the API concurrently (default: 4)
+        use_cache: Reuse results cached locally from previous runs (default: True)
+        output_path: Optional output file; chunked conversions are streamed into it
+        max_tokens_per_chunk: Pack pages into chunks by estimated tokens instead of chunk_size (optional)
+        controller: Optional ConcurrencyController shared across conversions (e.g. batch mode)
+        prompt_cache_name: Optional server-side cache holding the prompt, from create_single_file_prompt_cache
+            (non-chunking mode only)
+        pdf_bytes: PDF content already in memory (e.g. an upload), used instead of reading pdf_path
+        stream_callback: Optional callback(text) receiving the markdown as it is produced: the raw
+            response text in non-chunking mode, stitched chunks in page order in chunking mode;
+            called with None when the text received so far was discarded (the request is retried)
+        use_text_layer: Convert born-digital PDFs locally from their text layer (needs pymupdf4llm)
+            instead of calling the API; scanned or image-heavy PDFs still use the API
+        allow_partial: Return the chunks that succeeded when others failed (default: True);
+            if False, IncompleteConversionError is raised instead, carrying that partial result
+
+    Returns:
+        Markdown string, or None if it was written to output_path
     """
     from google.genai import types
 
+    # Internal helpers accept either a path or the bytes themselves
+    source = pdf_bytes if pdf_bytes is not None else pdf_path
+
     # Default model
     if model_name is None:
         model_name = 'gemini-3-flash-preview'
@@ -311,100 +894,185 @@ def convert_pdf_to_markdown(pdf_path: str, api_key: str, prompt: str = None, bas
     if prompt is None:
         prompt = load_prompt()
 
-    # Configure client - always use Client, never use configure()
-    if base_url:
-        http_options = types.HttpOptions(baseUrl=base_url)
-        client = genai.Client(api_key=api_key, http_options=http_options)
-    else:
-        client = genai.Client(api_key=api_key)
+    client = create_client(api_key, base_url)
 
-    # Determine config based on model
-    if model_name.startswith('gemini-3'):
-        config = types.GenerateContentConfig(
-            thinking_config=types.ThinkingConfig(thinking_level=types.ThinkingLevel.HIGH)
-        )
-    else:
-        config = types.GenerateContentConfig(
-            thinking_config=types.ThinkingConfig(thinking_budget=1024)
-        )
+    config = generation_config(model_name)
 
-    # Check if we should use chunking
-    # Auto-enable chunking for PDFs with more than 10 pages unless explicitly disabled
-    if not use_chunking:
-        try:
-            doc = fitz.open(pdf_path)
-            page_count = len(doc)
-            doc.close()
+    # Open the document once: for the page count and, when chunking, for extraction
+    try:
+        doc = open_pdf(source)
+    except Exception:
+        doc = None
+
+    try:
+        # Born-digital PDFs can skip the API entirely
+        if use_text_layer and doc is not None and has_usable_text_layer(doc):
+            markdown_content = text_layer_to_markdown(doc)
+            if markdown_content is not None:
+                print("Converted locally from the PDF text layer")
+                if output_path:
+                    save_markdown(markdown_content, output_path)
+                    return None
+                return markdown_content
+
+        # Check if we should use chunking
+        # Auto-enable chunking for PDFs with more than 10 pages unless explicitly disabled
+        if not use_chunking and doc is not None:
+            with FITZ_LOCK:
+                page_count = len(doc)
             if page_count > 10:
                 print(f"PDF has {page_count} pages, enabling chunking by default...")
                 use_chunking = True
-        except Exception:
-            pass
 
-    # Use chunking if enabled
-    if use_chunking and chunk_size > 0:
-        print(f"Using chunking mode with {chunk_size} page(s) per chunk...")
-        return _convert_pdf_with_chunking(pdf_path, client, model_name, prompt, config, chunk_size, progress_callback)
+        # Use chunking if enabled
+        if use_chunking and (chunk_size > 0 or max_tokens_per_chunk):
+            if max_tokens_per_chunk:
+                print(f"Using chunking mode with up to ~{max_tokens_per_chunk} tokens per chunk...")
+            else:
+                print(f"Using chunking mode with {chunk_size} page(s) per chunk...")
+            return _convert_pdf_with_chunking(source, client, model_name, prompt, config, chunk_size,
+                                              progress_callback, max_concurrency, use_cache, output_path,
+                                              doc=doc, max_tokens_per_chunk=max_tokens_per_chunk,
+                                              controller=controller, stream_callback=stream_callback,
+                                              allow_partial=allow_partial)
+    finally:
+        if doc is not None:
+            with FITZ_LOCK:
+                doc.close()
 
     # Non-chunking conversion with retry - call progress callback at start and end
     if progress_callback:
         # For non-chunking, we don't have granular progress, so just mark start and complete
         progress_callback(1, 1, 0, 0, 1)
-    return _convert_pdf_no_chunking_with_retry(pdf_path, client, model_name, prompt, config, stream)
 
+    # The same PDF, prompt and model (which determines the thinking config) give the same result
+    if use_cache:
+        digest = hashlib.sha256(pdf_bytes).hexdigest() if pdf_bytes is not None else file_sha256(pdf_path)
+        key = cache_key(digest, model_name, prompt)
+    else:
+        key = None
+    markdown_content = cache_get('documents', key) if key else None
+    if markdown_content is not None:
+        print("Using cached result")
+        if output_path:
+            save_markdown(markdown_content, output_path)
+            return None
+        return markdown_content
+
+    # Large files are recompressed, then uploaded once and referenced so the same
+    # bytes aren't re-sent on every retry
+    source = shrink_pdf(source)
+    pdf_size = len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+    if not pdf_size:
+        # An empty Part would only come back as an opaque API error, after retries
+        raise ValueError("PDF is empty")
+    uploaded = upload_pdf(client, source) if pdf_size > INLINE_PDF_LIMIT else None
+    pdf_part = types.Part.from_uri(file_uri=uploaded.uri, mime_type='application/pdf') if uploaded else None
+    try:
+        markdown_content = _convert_pdf_no_chunking_with_retry(source, client, model_name, prompt, config, stream,
+                                                               controller=controller, pdf_part=pdf_part,
+                                                               cached_content=prompt_cache_name,
+                                                               output_path=output_path, stream_callback=stream_callback)
+    finally:
+        delete_uploaded_pdf(client, uploaded)
+    if key and markdown_content:
+        cache_set('documents', key, markdown_content)
+    # Already written to output_path by the conversion
+    return None if output_path else markdown_content
+
+
+def build_single_file_prompt(prompt: str) -> str:
+    """Fill the prompt template for non-chunking mode, where the whole PDF is attached"""
+    # Replace placeholders with appropriate values
+    processed_prompt = prompt.replace('{PREV_CONTEXT}', '(No previous context - single file mode)')
+    processed_prompt = processed_prompt.replace('{PREVIOUS_CONTEXT}', '(No previous context - single file mode)')
+    processed_prompt = processed_prompt.replace('{PDF_CONTENT}', '[PDF content attached]')
+    processed_prompt = processed_prompt.replace('{CURRENT_PDF_CONTENT}', '[PDF content attached]')
+
+    return f"{processed_prompt}\n\nPlease convert the following PDF to Markdown:"
+
+
+def create_single_file_prompt_cache(client, model_name: str, prompt: str):
+    """Cache the non-chunking prompt server-side so a batch sends it only once
 
-def _convert_pdf_no_chunking(pdf_path: str, client, model_name: str, prompt: str, config, stream: bool = True) -> str:
+    Returns:
+        The CachedContent handle (pass its name as prompt_cache_name), or None if not cached
+    """
+    return create_prompt_cache(client, model_name, build_single_file_prompt(prompt))
+
+
+def _convert_pdf_no_chunking(pdf_path, client, model_name: str, prompt: str, config, stream: bool = True,
+                             pdf_part=None, cached_content: str = None, output_path: str = None,
+                             stream_callback: callable = None) -> str:
     """Convert PDF without chunking, with retry support for 503/429 errors
 
     Args:
-        pdf_path: Path to PDF file
+        pdf_path: Path to PDF file, or its bytes
         client: Gemini client
         model_name: Model name
         prompt: Prompt template
         config: Generation config
         stream: Use streaming mode
+        pdf_part: Optional pre-built PDF part (e.g. a File API reference); read from pdf_path if omitted
+        cached_content: Optional name of a server-side cache already holding the prompt
+        output_path: Optional output file; streamed text is written to it as it arrives
+        stream_callback: Optional callback(text) called with each streamed piece of text, and
+            with None if the attempt fails after streaming some (a retry starts from scratch)
 
     Returns:
         Markdown string
     """
     from google.genai import types
 
-    # Encode PDF
-    pdf_data = encode_pdf_to_base64(pdf_path)
-
-    # Process prompt to handle placeholders for non-chunking mode
-    # Replace placeholders with appropriate values
-    processed_prompt = prompt.replace('{PREV_CONTEXT}', '(No previous context - single file mode)')
-    processed_prompt = processed_prompt.replace('{PREVIOUS_CONTEXT}', '(No previous context - single file mode)')
-    processed_prompt = processed_prompt.replace('{PDF_CONTENT}', '[PDF content attached]')
-    processed_prompt = processed_prompt.replace('{CURRENT_PDF_CONTENT}', '[PDF content attached]')
-
-    # Create the prompt with PDF
-    full_prompt = f"{processed_prompt}\n\nPlease convert the following PDF to Markdown:"
+    # Use types.Part to wrap the PDF content; Part.from_bytes takes the raw bytes
+    if pdf_part is None:
+        pdf_part = types.Part.from_bytes(
+            data=read_pdf_bytes(pdf_path),
+            mime_type='application/pdf'
+        )
 
-    # Use types.Part to wrap the PDF content
-    pdf_part = types.Part.from_bytes(
-        data=base64.b64decode(pdf_data) if pdf_data else b'',
-        mime_type='application/pdf'
-    )
-    text_part = types.Part.from_text(text=full_prompt)
+    # With a cached prompt only the PDF is sent
+    if cached_content:
+        contents = [pdf_part]
+        config = config.model_copy(update={'cached_content': cached_content})
+    else:
+        contents = [pdf_part, types.Part.from_text(text=build_single_file_prompt(prompt))]
 
     # Use streaming to avoid timeouts on large files
     if stream:
         print("Using streaming mode...")
-        full_text = ""
+        parts = []
+        # Write to a temp file next to output_path, renamed into place once complete
+        out_file = tmp_path = None
+        if output_path:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix='.part')
+            out_file = os.fdopen(fd, 'w', encoding='utf-8')
         try:
             for chunk in client.models.generate_content_stream(
                 model=model_name,
-                contents=[pdf_part, text_part],
+                contents=contents,
                 config=config
             ):
                 if chunk.text:
-                    full_text += chunk.text
+                    parts.append(chunk.text)
+                    if out_file:
+                        out_file.write(chunk.text)
+                    if stream_callback:
+                        stream_callback(chunk.text)
                     print(".", end="", flush=True)
             print(" done!")
-            return full_text
+            if out_file:
+                out_file.close()
+                os.replace(tmp_path, output_path)
+                print(f"Markdown saved to: {output_path}")
+            return ''.join(parts)
         except Exception as e:
+            if out_file:
+                out_file.close()
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            if stream_callback and parts:
+                stream_callback(None)
             if is_retryable_error(e):
                 print(f"\nRetryable error detected: {e}")
                 raise  # Let retry decorator handle it
@@ -413,23 +1081,15 @@ def _convert_pdf_no_chunking(pdf_path: str, client, model_name: str, prompt: str
     else:
         # Non-streaming mode
         try:
-            if model_name.startswith('gemini-3'):
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=[pdf_part, text_part],
-                    config=types.GenerateContentConfig(
-                        thinking_config=types.ThinkingConfig(thinking_level=types.ThinkingLevel.HIGH)
-                    )
-                )
-            else:
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=[pdf_part, text_part],
-                    config=types.GenerateContentConfig(
-                        thinking_config=types.ThinkingConfig(thinking_budget=1024)
-                    )
-                )
-            return response.text if response.text else ""
+            response = client.models.generate_content(
+                model=model_name,
+                contents=contents,
+                config=config
+            )
+            markdown_content = response.text if response.text else ""
+            if output_path:
+                save_markdown(markdown_content, output_path)
+            return markdown_content
         except Exception as e:
             if is_retryable_error(e):
                 print(f"\nRetryable error detected: {e}")
@@ -438,102 +1098,466 @@ def _convert_pdf_no_chunking(pdf_path: str, client, model_name: str, prompt: str
                 raise
 
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=2, min=2, max=60),
-    retry=retry_if_exception_type(Exception),
-    reraise=True
-)
-def _convert_pdf_no_chunking_with_retry(pdf_path: str, client, model_name: str, prompt: str, config, stream: bool = True) -> str:
-    """Wrapper for non-chunking conversion with retry logic"""
-    return _convert_pdf_no_chunking(pdf_path, client, model_name, prompt, config, stream)
+@with_retry
+def _convert_pdf_no_chunking_with_retry(pdf_path, client, model_name: str, prompt: str, config, stream: bool = True,
+                                        controller: ConcurrencyController = None, pdf_part=None,
+                                        cached_content: str = None, output_path: str = None,
+                                        stream_callback: callable = None) -> str:
+    """Wrapper for non-chunking conversion with retry logic
+
+    With a controller, the request holds one of its slots so it counts against the
+    same concurrency limit as chunk requests (e.g. in batch mode), and its latency
+    is recorded like a chunk's: time to first token when streaming, otherwise the
+    time to the full response.
+    """
+    if controller is None:
+        return _convert_pdf_no_chunking(pdf_path, client, model_name, prompt, config, stream,
+                                        pdf_part, cached_content, output_path, stream_callback)
+    t0 = time.monotonic()
+    first_token = False
+
+    def on_text(text):
+        nonlocal first_token
+        if text and not first_token:
+            first_token = True
+            controller.record(time.monotonic() - t0)
+        if stream_callback:
+            stream_callback(text)
+
+    with controller.slot():
+        try:
+            content = _convert_pdf_no_chunking(pdf_path, client, model_name, prompt, config, stream,
+                                               pdf_part, cached_content, output_path, on_text)
+        except Exception as e:
+            controller.record(time.monotonic() - t0, e)
+            raise
+    if not first_token:
+        controller.record(time.monotonic() - t0)
+    return content
 
 
-def _convert_pdf_with_chunking(pdf_path: str, client, model_name: str, prompt_template: str,
-                               config, chunk_size: int = 1, progress_callback: callable = None) -> str:
-    """Internal function to convert PDF using chunking
+def upload_pdf(client, pdf_path):
+    """Upload a PDF once via the Gemini File API so chunk requests can reference it
 
     Args:
-        pdf_path: Path to the PDF file
         client: Gemini client
-        model_name: Model name
-        prompt_template: Prompt template with placeholders
-        config: Generation config
-        chunk_size: Number of pages per chunk
-        progress_callback: Optional callback function(current_chunk, total_chunks, page_start, page_end) for progress updates
+        pdf_path: Path to the PDF file, or its bytes
 
     Returns:
-        Combined markdown string
+        The uploaded File handle once it is ACTIVE, or None if the upload is not
+        supported, failed or is still processing after 30 seconds
     """
     from google.genai import types
 
-    # Get total page count
-    doc = fitz.open(pdf_path)
-    total_pages = len(doc)
-    doc.close()
+    try:
+        file = io.BytesIO(pdf_path) if isinstance(pdf_path, (bytes, bytearray)) else pdf_path
+        uploaded = client.files.upload(file=file, config=types.UploadFileConfig(mime_type='application/pdf'))
+        # Wait (briefly) until the file can be referenced
+        for _ in range(30):
+            state = getattr(getattr(uploaded, 'state', None), 'name', None)
+            if state != 'PROCESSING':
+                break
+            time.sleep(1)
+            uploaded = client.files.get(name=uploaded.name)
+        state = getattr(getattr(uploaded, 'state', None), 'name', None)
+        if state != 'ACTIVE':
+            # Requests referencing a file that isn't ACTIVE fail; fall back instead
+            delete_uploaded_pdf(client, uploaded)
+            raise RuntimeError(f"file not ready (state: {state})")
+        return uploaded
+    except Exception as e:
+        print(f"Warning: Could not upload PDF via the File API: {e}")
+        return None
 
-    print(f"Processing {total_pages} pages in chunks of {chunk_size}...")
 
-    chunks = []
-    prev_context = ""
-    total_chunks = (total_pages + chunk_size - 1) // chunk_size
+def delete_uploaded_pdf(client, uploaded):
+    """Delete a file previously uploaded with upload_pdf (errors are ignored)"""
+    if uploaded is None:
+        return
+    try:
+        client.files.delete(name=uploaded.name)
+    except Exception as e:
+        print(f"Warning: Could not delete uploaded PDF {uploaded.name}: {e}")
 
-    # Process in chunks
-    for start_page in range(0, total_pages, chunk_size):
-        end_page = min(start_page + chunk_size - 1, total_pages - 1)
-        chunk_num = start_page // chunk_size + 1
 
-        print(f"Processing chunk {chunk_num}/{total_chunks} (pages {start_page + 1}-{end_page + 1})...")
+def compile_prompt_template(prompt_template: str) -> list:
+    """Split a prompt template once into static text and placeholder names
 
-        # Call progress callback if provided
-        if progress_callback:
-            progress_callback(chunk_num, total_chunks, start_page, end_page, total_pages)
+    Returns:
+        List alternating static segments (even indices) and placeholder names (odd indices)
+    """
+    return PROMPT_PLACEHOLDER_RE.split(prompt_template)
 
-        try:
-            chunk_text = convert_chunk_with_retry(
-                client=client,
-                model_name=model_name,
-                pdf_path=pdf_path,
-                page_start=start_page,
-                page_end=end_page,
-                prev_context=prev_context,
-                prompt_template=prompt_template,
-                config=config
+
+def split_prompt_template(prompt_template: str) -> tuple:
+    """Split a prompt template into its static prefix and the placeholder-bearing suffix
+
+    Returns:
+        (prefix, suffix); prefix is empty if the template has no placeholders
+    """
+    match = PROMPT_PLACEHOLDER_RE.search(prompt_template)
+    if not match:
+        return "", prompt_template
+    return prompt_template[:match.start()], prompt_template[match.start():]
+
+
+def create_prompt_cache(client, model_name: str, prefix: str, pdf_part=None, ttl: str = PROMPT_CACHE_TTL):
+    """Create a server-side cached content for the parts shared by every chunk request
+
+    Args:
+        client: Gemini client
+        model_name: Model name
+        prefix: Static part of the prompt template
+        pdf_part: Optional PDF part shared by all chunks
+        ttl: Cache lifetime
+
+    Returns:
+        The CachedContent handle, or None if caching is not possible (e.g. a prompt-only
+        prefix below the model's minimum cacheable size)
+    """
+    from google.genai import types
+
+    # A prompt alone is often below the minimum; with the PDF attached the API decides
+    if pdf_part is None and estimate_tokens(prefix) < PROMPT_CACHE_MIN_TOKENS:
+        return None
+    parts = [pdf_part] if pdf_part else []
+    parts.append(types.Part.from_text(text=prefix))
+    try:
+        return client.caches.create(
+            model=model_name,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role='user', parts=parts)],
+                ttl=ttl,
+                display_name='pdf2md-prompt-prefix'
             )
+        )
+    except Exception as e:
+        print(f"Note: Prompt prefix caching not used: {e}")
+        return None
+
+
+@contextmanager
+def keep_prompt_cache_alive(client, cache, ttl: str = PROMPT_CACHE_TTL,
+                            interval: float = PROMPT_CACHE_REFRESH):
+    """Extend the TTL of a cache from create_prompt_cache while the block runs
+
+    Requests referencing an expired cache fail with a 4xx that is not retried, so
+    runs longer than the TTL refresh it from a background thread. No-op for None.
+    """
+    if cache is None:
+        yield
+        return
+    from google.genai import types
+
+    stop = threading.Event()
+
+    def refresh():
+        while not stop.wait(interval):
+            try:
+                client.caches.update(name=cache.name, config=types.UpdateCachedContentConfig(ttl=ttl))
+            except Exception as e:
+                print(f"Warning: Could not extend prompt cache {cache.name}: {e}")
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
 
+def delete_prompt_cache(client, cache):
+    """Delete a cache created with create_prompt_cache (errors are ignored)"""
+    if cache is None:
+        return
+    try:
+        client.caches.delete(name=cache.name)
+    except Exception as e:
+        print(f"Warning: Could not delete prompt cache {cache.name}: {e}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate: ~4 ASCII characters per token, one token per other character (e.g. CJK)"""
+    non_ascii = len(text) - len(text.encode('ascii', 'ignore'))
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def plan_chunks(pages: list, chunk_size: int, max_tokens_per_chunk: int = None) -> list:
+    """Split pages into (start, end) page index ranges, end inclusive
+
+    With max_tokens_per_chunk, consecutive pages are packed greedily while their
+    estimated token count fits the budget (a single oversized page gets its own
+    chunk) and chunk_size is ignored; otherwise every chunk has chunk_size pages.
+    """
+    total_pages = len(pages)
+    if not max_tokens_per_chunk:
+        return [(start, min(start + chunk_size - 1, total_pages - 1))
+                for start in range(0, total_pages, chunk_size)]
+
+    ranges = []
+    start, cur_tokens = 0, 0
+    for index, page in enumerate(pages):
+        page_tokens = estimate_tokens(page['text'])
+        if index > start and cur_tokens + page_tokens > max_tokens_per_chunk:
+            ranges.append((start, index - 1))
+            start, cur_tokens = index, 0
+        cur_tokens += page_tokens
+    if total_pages:
+        ranges.append((start, total_pages - 1))
+    return ranges
+
+
+def _convert_pdf_with_chunking(pdf_path, client, model_name: str, prompt_template: str,
+                               config, chunk_size: int = 1, progress_callback: callable = None,
+                               max_concurrency: int = DEFAULT_MAX_CONCURRENCY, use_cache: bool = True,
+                               output_path: str = None, doc=None, max_tokens_per_chunk: int = None,
+                               controller: ConcurrencyController = None,
+                               stream_callback: callable = None, allow_partial: bool = True) -> str:
+    """Internal function to convert PDF using chunking
+
+    Chunks are sent to the API concurrently. To break the serial dependency on the
+    previous chunk's output, each chunk receives the trailing text of the page right
+    before it (taken from the PDF's text layer) as its context. The number of
+    in-flight requests starts at `max_concurrency` and is adapted by a
+    ConcurrencyController (AIMD) based on latency and rate-limit errors.
+
+    The PDF is uploaded once through the File API and referenced by URI from every
+    chunk request; if the upload fails, chunks are sent as text only. The PDF
+    reference and the static prompt prefix are stored in a server-side context
+    cache when possible, so each request only carries the per-chunk suffix.
+    PDFs with more than SPLIT_PDF_MIN_PAGES pages are instead split by page range:
+    each chunk carries a small PDF of just its own pages.
+
+    Chunk results are also cached on disk, keyed by model, prompt template, context
+    and chunk text, so re-runs only call the API for chunks whose content changed.
+
+    Chunks are stitched incrementally in page order as soon as their predecessors
+    are done; with `output_path` the result is streamed to that file instead of
+    being held in memory.
+
+    Args:
+        pdf_path: Path to the PDF file, or its bytes
+        client: Gemini client
+        model_name: Model name
+        prompt_template: Prompt template with placeholders
+        config: Generation config
+        chunk_size: Number of pages per chunk
+        progress_callback: Optional callback function(current_chunk, total_chunks, page_start, page_end) for progress updates
+        max_concurrency: Initial number of chunks processed at the same time
+        use_cache: Reuse and store chunk results in the local cache (default: True)
+        output_path: Optional file to stream the stitched markdown into
+        doc: Optional already open fitz.Document for pdf_path
+        max_tokens_per_chunk: Optional token budget; pages are packed up to it instead of chunk_size
+        controller: Optional shared ConcurrencyController; a new one is created if omitted
+        stream_callback: Optional callback(text) called with each piece of stitched markdown,
+            in page order, as soon as it can be emitted
+        allow_partial: If False, raise IncompleteConversionError when any chunk failed
+
+    Returns:
+        Combined markdown string, or None when written to output_path
+    """
+    from google.genai import types
+
+    # Extract every page's text once; chunk planning and chunk workers share it
+    pages = extract_pdf_pages(pdf_path, include_empty=True, doc=doc)
+    total_pages = len(pages)
+
+    # Page ranges and the context for each chunk (tail of the preceding page)
+    chunk_ranges = []
+    for start_page, end_page in plan_chunks(pages, chunk_size, max_tokens_per_chunk):
+        prev_context = pages[start_page - 1]['text'][-CONTEXT_CHAR_LIMIT:] if start_page > 0 else ""
+        chunk_ranges.append((start_page, end_page, prev_context))
+
+    total_chunks = len(chunk_ranges)
+    results = [None] * total_chunks
+    finished = [False] * total_chunks
+    completed = 0
+    failed = 0
+
+    # Output sink: stream to a temp file next to output_path, or collect in memory
+    stitcher = MarkdownStitcher()
+    out_parts = []
+    out_file = tmp_path = None
+    if output_path:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix='.part')
+        out_file = os.fdopen(fd, 'w', encoding='utf-8')
+    sink = out_file.write if out_file else out_parts.append
+
+    def emit(text):
+        sink(text)
+        if stream_callback and text:
+            stream_callback(text)
+
+    next_index = 0
+    written = 0
+
+    def flush():
+        """Stitch and emit every chunk whose predecessors are all finished"""
+        nonlocal next_index, written
+        while next_index < total_chunks and finished[next_index]:
+            chunk_text = results[next_index]
             if chunk_text:
-                chunks.append(chunk_text)
-                # Update context for next chunk (last 500 chars)
-                prev_context = chunk_text[-CONTEXT_CHAR_LIMIT:] if len(chunk_text) > CONTEXT_CHAR_LIMIT else chunk_text
+                emit(stitcher.add(chunk_text))
+                written += 1
+            elif chunk_text is not None:
+                print(f"Warning: Empty result for chunk {next_index + 1}")
+            # Emitted; don't keep it in memory
+            results[next_index] = None
+            next_index += 1
+
+    try:
+        # Serve unchanged chunks from the local cache; the rest go to the API
+        keys = [None] * total_chunks
+        pending = []
+        for index, (start_page, end_page, prev_context) in enumerate(chunk_ranges):
+            chunk_text = build_chunk_text(pages[start_page:end_page + 1])
+            if not chunk_text:
+                results[index] = ""
+                finished[index] = True
+                continue
+            if use_cache:
+                keys[index] = cache_key(model_name, prompt_template, prev_context, chunk_text)
+                cached = cache_get('chunks', keys[index])
+                if cached is not None:
+                    results[index] = cached
+                    finished[index] = True
+                    completed += 1
+                    if progress_callback:
+                        progress_callback(completed, total_chunks, start_page, end_page, total_pages)
+                    continue
+            pending.append(index)
+        flush()
+
+        if controller is None:
+            controller = ConcurrencyController(c_start=max_concurrency)
+        # The pool is sized for the controller's ceiling; the controller gates actual API calls
+        max_workers = max(1, min(int(controller.c_max), len(pending)))
+        chunk_desc = f"up to ~{max_tokens_per_chunk} tokens" if max_tokens_per_chunk else f"{chunk_size} page(s)"
+        print(f"Processing {total_pages} pages in {total_chunks} chunks of {chunk_desc} "
+              f"({len(pending)} to convert, {controller.limit} concurrent)...")
+
+        if pending:
+            chunk_pdf_parts = {}
+            if total_pages > SPLIT_PDF_MIN_PAGES:
+                # Too large to attach whole to every chunk: give each chunk its own pages
+                uploaded = pdf_part = None
+                range_doc = doc
+                try:
+                    if range_doc is None:
+                        range_doc = open_pdf(pdf_path)
+                    for index in pending:
+                        start_page, end_page, _ = chunk_ranges[index]
+                        chunk_pdf_parts[index] = types.Part.from_bytes(
+                            data=extract_page_range(range_doc, start_page, end_page),
+                            mime_type='application/pdf'
+                        )
+                except Exception as e:
+                    print(f"Warning: Could not split PDF, chunks will be sent as text only: {e}")
+                    chunk_pdf_parts = {}
+                finally:
+                    if range_doc is not None and range_doc is not doc:
+                        with FITZ_LOCK:
+                            range_doc.close()
             else:
-                print(f"Warning: Empty result for chunk {chunk_num}")
+                # Upload the PDF once; every chunk references it instead of re-sending the bytes
+                uploaded = upload_pdf(client, shrink_pdf(pdf_path))
+                pdf_part = types.Part.from_uri(file_uri=uploaded.uri, mime_type='application/pdf') if uploaded else None
+
+            # Cache the shared prefix (PDF reference + static instructions) server-side
+            chunk_template, chunk_pdf_part, chunk_config = prompt_template, pdf_part, config
+            prefix, suffix = split_prompt_template(prompt_template)
+            cache = create_prompt_cache(client, model_name, prefix, pdf_part)
+            if cache is not None:
+                chunk_template, chunk_pdf_part = suffix, None
+                chunk_config = config.model_copy(update={'cached_content': cache.name})
+            # Parse the template once instead of scanning it for placeholders per chunk
+            chunk_template = compile_prompt_template(chunk_template)
+
+            try:
+                # Large documents can take longer than the cache's TTL
+                with keep_prompt_cache_alive(client, cache), \
+                        ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {}
+                    for index in pending:
+                        start_page, end_page, prev_context = chunk_ranges[index]
+                        future = executor.submit(
+                            convert_chunk_with_retry,
+                            client=client,
+                            model_name=model_name,
+                            pages_slice=pages[start_page:end_page + 1],
+                            prev_context=prev_context,
+                            prompt_template=chunk_template,
+                            config=chunk_config,
+                            controller=controller,
+                            pdf_part=chunk_pdf_parts.get(index, chunk_pdf_part)
+                        )
+                        futures[future] = index
+
+                    for future in as_completed(futures):
+                        index = futures[future]
+                        start_page, end_page, _ = chunk_ranges[index]
+                        chunk_num = index + 1
+                        completed += 1
+
+                        try:
+                            results[index] = future.result()
+                            print(f"Finished chunk {chunk_num}/{total_chunks} (pages {start_page + 1}-{end_page + 1})")
+                            if use_cache and results[index]:
+                                cache_set('chunks', keys[index], results[index])
+                        except Exception as e:
+                            # Keep the other chunks instead of failing completely
+                            print(f"Error processing chunk {chunk_num}: {e}")
+                            failed += 1
+                        finished[index] = True
+                        flush()
+
+                        # Progress callbacks run on the calling thread (required by Streamlit)
+                        if progress_callback:
+                            progress_callback(completed, total_chunks, start_page, end_page, total_pages)
+            finally:
+                delete_prompt_cache(client, cache)
+                delete_uploaded_pdf(client, uploaded)
+
+        emit(stitcher.finish())
+        if out_file:
+            out_file.close()
+            os.replace(tmp_path, output_path)
+            print(f"Markdown saved to: {output_path}")
+    except BaseException:
+        if out_file:
+            out_file.close()
+            os.unlink(tmp_path)
+        raise
 
-        except Exception as e:
-            print(f"Error processing chunk {chunk_num}: {e}")
-            # Continue with next chunk instead of failing completely
-            continue
+    if failed and not allow_partial:
+        raise IncompleteConversionError(None if output_path else ''.join(out_parts), failed, total_chunks)
 
-    if not chunks:
+    if not written:
         print("Warning: No chunks were successfully processed")
-        return ""
-
-    # Stitch chunks together
-    print("Stitching chunks together...")
-    result = stitch_markdown_chunks(chunks)
+        return None if output_path else ""
 
-    print(f"Conversion completed! Total chunks: {len(chunks)}")
-    return result
+    print(f"Conversion completed! Total chunks: {written}")
+    return None if output_path else ''.join(out_parts)
 
 
 def save_markdown(content: str, output_path: str):
-    """Save markdown content to file"""
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    """Save markdown content to file
+
+    Written in slices so that only one slice at a time is held in encoded form.
+    """
+    step = SAVE_SLICE_CHARS
+    with open(output_path, 'w', encoding='utf-8', buffering=step) as f:
+        for start in range(0, len(content), step):
+            f.write(content[start:start + step])
     print(f"Markdown saved to: {output_path}")
 
 
 def process_single_pdf(pdf_path: str, api_key: str, prompt: str, base_url: str, model_name: str,
-                      output_dir: str = None, stream: bool = True, chunk_size: int = 1, use_chunking: bool = None):
+                      output_dir: str = None, stream: bool = True, chunk_size: int = 1, use_chunking: bool = None,
+                      max_concurrency: int = DEFAULT_MAX_CONCURRENCY, use_cache: bool = True,
+                      max_tokens_per_chunk: int = None, controller: ConcurrencyController = None,
+                      prompt_cache_name: str = None, duplicates: list = None, use_text_layer: bool = False):
     """Process a single PDF file
 
     Args:
@@ -546,28 +1570,37 @@ def process_single_pdf(pdf_path: str, api_key: str, prompt: str, base_url: str,
         stream: Use streaming mode
         chunk_size: Number of pages per chunk
         use_chunking: Enable chunking (None for auto)
+        max_concurrency: Initial number of chunks sent to the API concurrently
+        use_cache: Reuse results cached locally from previous runs
+        max_tokens_per_chunk: Pack pages into chunks by estimated tokens instead of chunk_size
+        controller: Optional ConcurrencyController shared by all PDFs of a batch
+        prompt_cache_name: Optional server-side prompt cache shared by all PDFs of a batch
+        duplicates: Other PDFs with identical content; the result is copied to their outputs
+        use_text_layer: Convert born-digital PDFs locally from their text layer
     """
     try:
         print(f"\nProcessing: {pdf_path}")
         print(f"Using model: {model_name}")
 
         # Determine output path
-        if output_dir:
-            pdf_name = Path(pdf_path).stem
-            output_file = os.path.join(output_dir, f"{pdf_name}.md")
-        else:
-            output_file = get_output_filename(pdf_path)
+        output_file = get_batch_output_filename(pdf_path, output_dir)
 
-        # Convert PDF to Markdown
-        markdown_content = convert_pdf_to_markdown(
+        # Convert PDF to Markdown and save to file
+        convert_pdf_to_markdown(
             pdf_path, api_key, prompt, base_url, model_name,
-            stream=stream, chunk_size=chunk_size, use_chunking=use_chunking
+            stream=stream, chunk_size=chunk_size, use_chunking=use_chunking,
+            max_concurrency=max_concurrency, use_cache=use_cache, output_path=output_file,
+            max_tokens_per_chunk=max_tokens_per_chunk, controller=controller,
+            prompt_cache_name=prompt_cache_name, use_text_layer=use_text_layer
         )
 
-        # Save to file
-        save_markdown(markdown_content, output_file)
-
         print(f"Completed: {output_file}")
+
+        for duplicate in duplicates or []:
+            duplicate_file = get_batch_output_filename(duplicate, output_dir)
+            if os.path.abspath(duplicate_file) != os.path.abspath(output_file):
+                shutil.copyfile(output_file, duplicate_file)
+            print(f"Completed: {duplicate_file} (identical to {pdf_path})")
         return True
 
     except Exception as e:
@@ -589,6 +1622,11 @@ def main():
     parser.add_argument('-c', '--chunk-size', type=int, default=5, help='Number of pages per chunk for large PDFs (default: 5, use 1 for more granular processing)')
     parser.add_argument('--no-chunking', dest='use_chunking', default=None, action='store_false', help='Disable automatic chunking for large PDFs')
     parser.add_argument('--force-chunking', dest='use_chunking', default=None, action='store_true', help='Force chunking for all PDFs')
+    parser.add_argument('-t', '--max-chunk-tokens', type=int, default=None, help='Pack pages into chunks of up to this many estimated tokens instead of a fixed --chunk-size (e.g. 30000); keep it within the model\'s output limit')
+    parser.add_argument('-j', '--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY, help=f'Initial number of chunks sent to the API concurrently, adapted to rate limits at runtime (default: {DEFAULT_MAX_CONCURRENCY})')
+    parser.add_argument('--parallel-pdfs', '--threads', type=int, default=DEFAULT_PARALLEL_PDFS, help=f'Number of PDFs converted concurrently in directory mode (default: {DEFAULT_PARALLEL_PDFS})')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Ignore and do not update the local result cache')
+    parser.add_argument('--text-layer', action='store_true', help='Convert born-digital PDFs locally from their text layer instead of the API (requires pymupdf4llm)')
     parser.add_argument('--include-toc', action='store_true', help='Include Table of Contents in output (default: skip TOC)')
 
     args = parser.parse_args()
@@ -618,8 +1656,14 @@ def main():
     # Get chunking options
     chunk_size = args.chunk_size
     use_chunking = args.use_chunking  # None = auto, True = force, False = disable
+    max_concurrency = args.max_concurrency
+    use_cache = args.use_cache
+    max_tokens_per_chunk = args.max_chunk_tokens
 
-    print(f"Chunk size: {chunk_size} page(s) per chunk")
+    if max_tokens_per_chunk:
+        print(f"Chunk size: up to ~{max_tokens_per_chunk} tokens per chunk")
+    else:
+        print(f"Chunk size: {chunk_size} page(s) per chunk")
     if use_chunking is None:
         print("Chunking: Auto (enabled for PDFs > 10 pages)")
     elif use_chunking:
@@ -641,7 +1685,7 @@ def main():
             output_dir = args.output if args.output else input_path
 
             # Find all PDF files
-            pdf_files = list(Path(input_path).glob("*.pdf"))
+            pdf_files = find_pdf_files(input_path)
 
             if not pdf_files:
                 print(f"No PDF files found in {input_path}")
@@ -654,17 +1698,38 @@ def main():
             if base_url:
                 print(f"Using custom base URL: {base_url}")
 
-            # Process each PDF
+            # Process PDFs concurrently; one controller keeps all API calls within the provider limit
+            controller = ConcurrencyController(c_start=max_concurrency)
+            parallel_pdfs = max(1, min(args.parallel_pdfs, len(pdf_files)))
             success_count = 0
             fail_count = 0
 
-            for pdf_file in pdf_files:
-                pdf_path = str(pdf_file)
-                if process_single_pdf(pdf_path, api_key, prompt, base_url, model_name, output_dir,
-                                     stream=stream_mode, chunk_size=chunk_size, use_chunking=use_chunking):
-                    success_count += 1
-                else:
-                    fail_count += 1
+            # Send the (identical) single-file prompt once for the whole batch
+            client = create_client(api_key, base_url)
+            prompt_cache = create_single_file_prompt_cache(client, model_name, prompt)
+            prompt_cache_name = prompt_cache.name if prompt_cache else None
+
+            try:
+                with keep_prompt_cache_alive(client, prompt_cache), \
+                        ThreadPoolExecutor(max_workers=parallel_pdfs) as executor:
+                    # Identical files are converted once and the result is copied
+                    futures = {
+                        executor.submit(process_single_pdf, str(group[0]), api_key, prompt, base_url, model_name,
+                                        output_dir, stream=stream_mode, chunk_size=chunk_size,
+                                        use_chunking=use_chunking, max_concurrency=max_concurrency,
+                                        use_cache=use_cache, max_tokens_per_chunk=max_tokens_per_chunk,
+                                        controller=controller, prompt_cache_name=prompt_cache_name,
+                                        duplicates=[str(p) for p in group[1:]],
+                                        use_text_layer=args.text_layer): len(group)
+                        for group in group_identical_pdfs(pdf_files)
+                    }
+                    for future in as_completed(futures):
+                        if future.result():
+                            success_count += futures[future]
+                        else:
+                            fail_count += futures[future]
+            finally:
+                delete_prompt_cache(client, prompt_cache)
 
             print(f"\n{'='*50}")
             print(f"Batch processing completed!")
@@ -686,15 +1751,14 @@ def main():
             if base_url:
                 print(f"Using custom base URL: {base_url}")
 
-            # Convert PDF to Markdown
-            markdown_content = convert_pdf_to_markdown(
+            # Convert PDF to Markdown and save to file
+            convert_pdf_to_markdown(
                 input_path, api_key, prompt, base_url, model_name,
-                stream=stream_mode, chunk_size=chunk_size, use_chunking=use_chunking
+                stream=stream_mode, chunk_size=chunk_size, use_chunking=use_chunking,
+                max_concurrency=max_concurrency, use_cache=use_cache, output_path=output_file,
+                max_tokens_per_chunk=max_tokens_per_chunk, use_text_layer=args.text_layer
             )
 
-            # Save to file
-            save_markdown(markdown_content, output_file)
-
             print("Conversion completed successfully!")
 
     except Exception as e:
@@ -3,38 +3,37 @@ PDF to Markdown Web UI
 Run: streamlit run webui.py
 """
 
-import sys
 import os
-import tempfile
-import json
-from pathlib import Path
-
-# Auto-install dependencies if not available
-def install_if_missing(package, import_name=None):
-    if import_name is None:
-        import_name = package
-    try:
-        __import__(import_name)
-    except ImportError:
-        print(f"Installing {package}...")
-        import subprocess
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-install_if_missing("streamlit")
-install_if_missing("google-genai", "google.genai")
-install_if_missing("python-dotenv", "dotenv")
-install_if_missing("pymupdf", "fitz")
-
 import io
+import json
 import zipfile
+import hashlib
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import streamlit as st
-import fitz
-from pdf2md import convert_pdf_to_markdown, load_prompt
+
+from pdf2md import (convert_pdf_to_markdown, load_prompt, clear_cache, create_client,
+                    create_single_file_prompt_cache, delete_prompt_cache, keep_prompt_cache_alive,
+                    ConcurrencyController,
+                    open_pdf, FITZ_LOCK, IncompleteConversionError, DEFAULT_MAX_CONCURRENCY, MAX_CONCURRENCY_LIMIT)
 
 
 # Settings file path
 SETTINGS_FILE = os.path.join(os.path.expanduser("~"), ".pdf2md_settings.json")
+# Converted results are kept here so they survive a page refresh or server restart
+RESULTS_DIR = os.path.join(os.path.expanduser("~"), ".pdf2md_results")
+RESULTS_INDEX = os.path.join(RESULTS_DIR, "index.json")
+# Only the most recent results are kept; older ones are deleted when new ones are saved
+RESULTS_MAX_ENTRIES = 100
+# Characters of the live Markdown preview shown while converting
+PREVIEW_CHARS = 3000
+# Conversions remembered per browser session, reused when the same file is converted again
+SESSION_CACHE_SIZE = 32
 
 
 def load_settings():
@@ -69,22 +68,136 @@ def clear_settings():
         return False
 
 
+@st.cache_resource
+def _results_lock():
+    """Lock for the results store, shared by all sessions of this server"""
+    return threading.Lock()
+
+
+def _read_results_index() -> list:
+    """Entries of the results store (without their Markdown)"""
+    try:
+        with open(RESULTS_INDEX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _write_atomic(path, text):
+    """Write text via a unique temporary file so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def result_digest(md: str) -> str:
+    """Content hash identifying a result (together with its file name)"""
+    return hashlib.sha256(md.encode('utf-8')).hexdigest()
+
+
+def load_results():
+    """Load converted results saved by earlier sessions"""
+    results = []
+    with _results_lock():
+        for entry in _read_results_index():
+            try:
+                with open(os.path.join(RESULTS_DIR, entry["file"]), 'r', encoding='utf-8') as f:
+                    md = f.read()
+                results.append(dict(entry, md=md, sha256=entry.get("sha256") or result_digest(md)))
+            except (OSError, KeyError):
+                pass  # Markdown file removed by hand: drop the entry
+    return results
+
+
+def save_results(results):
+    """Add results to RESULTS_DIR; entries saved by other sessions are kept
+
+    Results already stored (same name and content) are not saved again, and only
+    the newest RESULTS_MAX_ENTRIES entries are kept.
+    """
+    if not results:
+        return
+    try:
+        with _results_lock():
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            index = _read_results_index()
+            stored = {(entry.get("name"), entry.get("sha256")): entry for entry in index}
+            for result in results:
+                existing = stored.get((result["name"], result["sha256"]))
+                if existing is not None:
+                    result["file"] = existing["file"]
+                    continue
+                result["file"] = uuid.uuid4().hex + ".md"
+                _write_atomic(os.path.join(RESULTS_DIR, result["file"]), result["md"])
+                entry = {k: v for k, v in result.items() if k != "md"}
+                index.append(entry)
+                stored[(result["name"], result["sha256"])] = entry
+            expired, index = index[:-RESULTS_MAX_ENTRIES], index[-RESULTS_MAX_ENTRIES:]
+            _write_atomic(RESULTS_INDEX, json.dumps(index, ensure_ascii=False, indent=2))
+            for entry in expired:
+                try:
+                    os.remove(os.path.join(RESULTS_DIR, entry["file"]))
+                except (OSError, KeyError):
+                    pass
+    except Exception as e:
+        st.error(f"Failed to save results: {e}")
+
+
+def remove_results(results):
+    """Delete the given results from RESULTS_DIR; entries of other sessions are kept"""
+    files = {result["file"] for result in results if "file" in result}
+    if not files:
+        return
+    try:
+        with _results_lock():
+            index = [entry for entry in _read_results_index() if entry.get("file") not in files]
+            _write_atomic(RESULTS_INDEX, json.dumps(index, ensure_ascii=False, indent=2))
+            for name in files:
+                try:
+                    os.remove(os.path.join(RESULTS_DIR, name))
+                except OSError:
+                    pass
+    except Exception as e:
+        st.error(f"Failed to delete saved results: {e}")
+
+
 def get_pdf_page_count(pdf_file) -> int:
     """Get page count of an uploaded PDF file"""
     try:
-        # Save to temp and read
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(pdf_file.getvalue())
-            tmp_path = tmp.name
-        doc = fitz.open(tmp_path)
-        page_count = len(doc)
-        doc.close()
-        os.unlink(tmp_path)
+        with FITZ_LOCK:
+            doc = open_pdf(pdf_file.getvalue())
+            page_count = len(doc)
+            doc.close()
         return page_count
     except Exception:
         return 1  # Default to 1 page if can't read
 
 
+@st.cache_data(ttl=60)
+def list_prompt_files() -> list:
+    """Prompt templates next to this script (cached across reruns)"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    with os.scandir(app_dir) as entries:
+        return sorted(e.name for e in entries
+                      if e.name.startswith('prompt') and e.name.endswith('.md') and e.is_file())
+
+
+@st.cache_data(max_entries=4)
+def build_zip(results: tuple) -> bytes:
+    """ZIP archive of (filename, markdown) pairs, rebuilt only when the results change"""
+    zip_buffer = io.BytesIO()
+    # Fastest deflate level: Markdown still shrinks several times, in a fraction of the CPU time
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+        for output_filename, md in results:
+            zip_file.writestr(output_filename, md)
+    return zip_buffer.getvalue()
+
+
 st.set_page_config(page_title="PDF to Markdown Converter", page_icon="📄", layout="wide")
 
 # Initialize session state for settings
@@ -94,11 +207,17 @@ if 'settings_loaded' not in st.session_state:
     st.session_state.base_url = saved_settings.get("base_url", "https://generativelanguage.googleapis.com/")
     st.session_state.model = saved_settings.get("model", "gemini-3-flash-preview")
     st.session_state.chunk_size = saved_settings.get("chunk_size", 5)
+    st.session_state.max_chunk_tokens = saved_settings.get("max_chunk_tokens", 0)
     st.session_state.use_stream = saved_settings.get("use_stream", True)
     st.session_state.force_chunking = saved_settings.get("force_chunking", False)
     st.session_state.include_toc = saved_settings.get("include_toc", False)
+    st.session_state.parallel_files = saved_settings.get("parallel_files", 4)
+    st.session_state.max_concurrency = saved_settings.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+    st.session_state.use_text_layer = saved_settings.get("use_text_layer", False)
+    st.session_state.use_cache = saved_settings.get("use_cache", True)
+    st.session_state.auto_convert = saved_settings.get("auto_convert", False)
     # Get available prompt files
-    prompt_files = [f for f in os.listdir(os.path.dirname(__file__)) if f.startswith('prompt') and f.endswith('.md')] if os.path.exists(os.path.dirname(__file__)) else []
+    prompt_files = list_prompt_files()
     default_prompt = saved_settings.get("prompt_option", prompt_files[0] if prompt_files else "prompt_general.md")
     st.session_state.prompt_option = default_prompt
     st.session_state.custom_prompt = saved_settings.get("custom_prompt", "")
@@ -107,7 +226,9 @@ if 'settings_loaded' not in st.session_state:
 
 # Initialize session state for persistent results
 if 'converted_results' not in st.session_state:
-    st.session_state.converted_results = []
+    st.session_state.converted_results = load_results()
+if 'conversion_cache' not in st.session_state:
+    st.session_state.conversion_cache = OrderedDict()
 
 
 # Header
@@ -127,9 +248,15 @@ with st.sidebar:
                 "base_url": st.session_state.base_url,
                 "model": st.session_state.model,
                 "chunk_size": st.session_state.chunk_size,
+                "max_chunk_tokens": st.session_state.max_chunk_tokens,
                 "use_stream": st.session_state.use_stream,
                 "force_chunking": st.session_state.force_chunking,
                 "include_toc": st.session_state.include_toc,
+                "parallel_files": st.session_state.parallel_files,
+                "max_concurrency": st.session_state.max_concurrency,
+                "use_text_layer": st.session_state.use_text_layer,
+                "use_cache": st.session_state.use_cache,
+                "auto_convert": st.session_state.auto_convert,
                 "prompt_option": st.session_state.prompt_option,
                 "custom_prompt": st.session_state.custom_prompt
             }
@@ -142,9 +269,15 @@ with st.sidebar:
                 st.session_state.base_url = "https://generativelanguage.googleapis.com/"
                 st.session_state.model = "gemini-3-flash-preview"
                 st.session_state.chunk_size = 5
+                st.session_state.max_chunk_tokens = 0
                 st.session_state.use_stream = True
                 st.session_state.force_chunking = False
                 st.session_state.include_toc = False
+                st.session_state.parallel_files = 4
+                st.session_state.max_concurrency = DEFAULT_MAX_CONCURRENCY
+                st.session_state.use_text_layer = False
+                st.session_state.use_cache = True
+                st.session_state.auto_convert = False
                 st.session_state.prompt_option = "prompt_general.md"
                 st.session_state.custom_prompt = ""
                 st.success("Settings cleared! ✅")
@@ -168,6 +301,13 @@ with st.sidebar:
                                      value=st.session_state.chunk_size, key="chunk_size_input")
         st.session_state.chunk_size = chunk_size
         
+        max_chunk_tokens = st.number_input("Max Tokens per Chunk", min_value=0, max_value=500000, step=1000,
+                                           value=st.session_state.max_chunk_tokens,
+                                           help="Pack pages into chunks by estimated tokens instead of a fixed "
+                                                "chunk size, so sparse pages share a request (0 = off)",
+                                           key="max_chunk_tokens_input")
+        st.session_state.max_chunk_tokens = max_chunk_tokens
+        
         use_stream = st.toggle("Stream Output", value=st.session_state.use_stream, 
                               key="use_stream_toggle")
         st.session_state.use_stream = use_stream
@@ -180,8 +320,25 @@ with st.sidebar:
                                 help="Include Table of Contents in output", key="include_toc_toggle")
         st.session_state.include_toc = include_toc
         
+        parallel_files = st.number_input("Parallel Files", min_value=1, max_value=16,
+                                         value=st.session_state.parallel_files,
+                                         help="Number of files converted at the same time", key="parallel_files_input")
+        st.session_state.parallel_files = parallel_files
+        
+        max_concurrency = st.number_input("Max Concurrent Requests", min_value=1, max_value=MAX_CONCURRENCY_LIMIT,
+                                          value=st.session_state.max_concurrency,
+                                          help="Initial limit on API requests in flight across all files; "
+                                               "lowered automatically when rate limited",
+                                          key="max_concurrency_input")
+        st.session_state.max_concurrency = max_concurrency
+        
+        use_text_layer = st.toggle("Use Text Layer", value=st.session_state.use_text_layer,
+                                   help="Convert born-digital PDFs locally without the API (requires pymupdf4llm)",
+                                   key="use_text_layer_toggle")
+        st.session_state.use_text_layer = use_text_layer
+        
         # Prompt file selection
-        prompt_files = [f for f in os.listdir(os.path.dirname(__file__)) if f.startswith('prompt') and f.endswith('.md')] if os.path.exists(os.path.dirname(__file__)) else []
+        prompt_files = list_prompt_files()
         if not prompt_files:
             prompt_files = ["prompt_general.md"]
         
@@ -193,6 +350,21 @@ with st.sidebar:
         prompt_option = st.selectbox("Prompt Template", prompt_files, index=prompt_index, key="prompt_select")
         st.session_state.prompt_option = prompt_option
         
+        use_cache = st.toggle("Use Cache", value=st.session_state.use_cache,
+                              help="Reuse results of unchanged PDFs/pages from earlier conversions",
+                              key="use_cache_toggle")
+        st.session_state.use_cache = use_cache
+        
+        auto_convert = st.toggle("Convert on Upload", value=st.session_state.auto_convert,
+                                 help="Start converting as soon as files are uploaded, without clicking Start Conversion",
+                                 key="auto_convert_toggle")
+        st.session_state.auto_convert = auto_convert
+        
+        if st.button("🧹 Clear Result Cache", use_container_width=True,
+                     help="Delete locally cached conversion results"):
+            st.session_state.conversion_cache.clear()
+            st.success(f"Removed {clear_cache()} cached result(s) ✅")
+        
     custom_prompt = st.text_area("Custom Prompt (optional)", height=200, 
                                  value=st.session_state.custom_prompt,
                                  placeholder="Or enter custom prompt here...", key="custom_prompt_input")
@@ -214,10 +386,17 @@ with col_input:
             
         st.write("") # spacing
         
-        if st.button("🚀 Start Conversion", type="primary", use_container_width=True):
+        start_clicked = st.button("🚀 Start Conversion", type="primary", use_container_width=True)
+        # With Convert on Upload, a new set of uploads starts converting right away (once)
+        upload_key = tuple((f.name, f.size) for f in uploaded_files)
+        auto_start = auto_convert and st.session_state.get("auto_converted_upload") != upload_key
+        
+        if start_clicked or auto_start:
             if not api_key:
                 st.error("❌ Please enter your Gemini API Key in the sidebar.")
             else:
+                # Recorded only once a conversion really starts (not when the key was missing)
+                st.session_state.auto_converted_upload = upload_key
                 # Determine which prompt to use
                 if custom_prompt.strip():
                     prompt = custom_prompt
@@ -234,72 +413,210 @@ with col_input:
                     file_page_counts.append(page_count)
                     total_pages += page_count
                 
-                progress_container = st.container()
-                progress_bar = progress_container.progress(0)
-                status_text = progress_container.empty()
+                # Files already converted in this session with the same settings are reused
+                conversion_cache = st.session_state.conversion_cache
+                settings_key = (hashlib.sha256(prompt.encode('utf-8')).hexdigest(), model,
+                                chunk_size, max_chunk_tokens, force_chunking, use_text_layer)
+                file_keys = [(hashlib.sha256(f.getvalue()).hexdigest(),) + settings_key for f in uploaded_files]
+                outputs = [None] * len(uploaded_files)
+                if use_cache:
+                    for i, key in enumerate(file_keys):
+                        if key in conversion_cache:
+                            conversion_cache.move_to_end(key)
+                            outputs[i] = conversion_cache[key]
+                # Identical uploads are converted once; the copies share the first one's result
+                first_of_key = {}
+                copies = {}
+                for i, output_md in enumerate(outputs):
+                    if output_md is None:
+                        first = first_of_key.setdefault(file_keys[i], i)
+                        if first != i:
+                            copies.setdefault(first, []).append(i)
+                to_convert = list(first_of_key.values())
+                if copies:
+                    skipped = sum(len(dups) for dups in copies.values())
+                    st.caption(f"♻️ {skipped} duplicate file(s) will reuse the result of an identical upload")
                 
-                for i, f in enumerate(uploaded_files):
-                    file_pages = file_page_counts[i]
-                    file_name = f.name  # Capture file name to avoid closure issues
-                    
-                    # Create progress callback for this file
-                    def make_progress_callback(file_idx, file_pages_count, current_file_name):
-                        def update_progress(chunk_num, total_chunks, page_start, page_end, file_total_pages):
-                            # Calculate base progress from previously processed files
-                            base_progress = sum(file_page_counts[:file_idx]) / total_pages
-                            
-                            if total_chunks > 1:
-                                # Chunked file: progress = base + (current_chunk_progress / total_pages)
-                                chunk_progress = chunk_num / total_chunks
-                                current_file_progress = (chunk_progress * file_pages_count) / total_pages
-                            else:
-                                # Non-chunked file: progress = base + (file_pages / total_pages)
-                                current_file_progress = file_pages_count / total_pages
-                            
-                            total_progress = min(base_progress + current_file_progress, 1.0)
-                            progress_bar.progress(total_progress)
-                            
-                            if total_chunks > 1:
-                                status_text.text(f"Processing {current_file_name}: Chunk {chunk_num}/{total_chunks} (pages {page_start+1}-{page_end+1})")
-                            else:
-                                status_text.text(f"Processing {current_file_name} ({file_pages_count} pages)")
-                        return update_progress
-                    
-                    progress_callback = make_progress_callback(i, file_pages, file_name)
-                    
-                    # Save uploaded file to temp
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_input:
-                        tmp_input.write(f.getvalue())
-                        tmp_input_path = tmp_input.name
-                    
-                    try:
-                        output_md = convert_pdf_to_markdown(
-                            pdf_path=tmp_input_path,
-                            api_key=api_key,
-                            prompt=prompt,
-                            base_url=base_url if base_url.strip() else None,
-                            model_name=model,
-                            chunk_size=chunk_size,
-                            stream=use_stream,
-                            use_chunking=force_chunking,
-                            progress_callback=progress_callback
-                        )
-                        
-                        # Store in session state
-                        st.session_state.converted_results.append({
-                            "name": f.name,
-                            "md": output_md,
-                            "id": f.name + "_" + str(len(st.session_state.converted_results))
+                # One status block: its label is the current step, the bar the overall progress
+                status = st.status(f"Converting {len(uploaded_files)} file(s)...", expanded=True)
+                progress_bar = status.progress(0)
+                preview = status.empty()
+                
+                # Several files share the same prompt: cache it server-side once
+                client = None
+                prompt_cache = None
+                if len(to_convert) > 1:
+                    client = create_client(api_key, base_url if base_url.strip() else None)
+                    prompt_cache = create_single_file_prompt_cache(client, model, prompt)
+                prompt_cache_name = prompt_cache.name if prompt_cache else None
+                
+                # One controller keeps the API calls of all files within the rate limit
+                controller = ConcurrencyController(c_start=max_concurrency)
+                
+                # Workers only record progress here; Streamlit elements are updated
+                # from this (the script) thread, as they can't be used from worker threads
+                file_progress = [0.0 if output_md is None else 1.0 for output_md in outputs]
+                file_status = [""] * len(uploaded_files)
+                # Only the tail of each file's text is kept, and a version number per file
+                # tells the polling loop whether the preview needs redrawing
+                file_text = [""] * len(uploaded_files)
+                file_version = [0] * len(uploaded_files)
+                last_streamed = [None]
+                shown = [None]
+                shown_label = None
+                shown_progress = None
+                
+                def make_progress_callback(file_idx, file_pages_count, current_file_name):
+                    pages_done = [0]
+                    def update_progress(chunk_num, total_chunks, page_start, page_end, file_total_pages):
+                        if total_chunks > 1:
+                            # Chunks differ in size: advance by the pages each finished chunk covered
+                            pages_done[0] += page_end - page_start + 1
+                            file_progress[file_idx] = min(pages_done[0] / max(file_total_pages, 1), 1.0)
+                            file_status[file_idx] = f"Processing {current_file_name}: Chunk {chunk_num}/{total_chunks} (pages {page_start+1}-{page_end+1})"
+                        else:
+                            # Non-chunked file: no granular progress
+                            file_progress[file_idx] = 1.0
+                            file_status[file_idx] = f"Processing {current_file_name} ({file_pages_count} pages)"
+                    return update_progress
+                
+                def make_stream_callback(file_idx, current_file_name):
+                    received = [0]
+                    def on_text(text):
+                        if text is None:
+                            # The attempt failed and is retried: its text starts over
+                            received[0] = 0
+                            file_text[file_idx] = ""
+                        else:
+                            # Markdown arrives piece by piece; keep its tail for the live preview
+                            received[0] += len(text)
+                            file_text[file_idx] = (file_text[file_idx] + text)[-PREVIEW_CHARS:]
+                        file_status[file_idx] = f"Receiving {current_file_name}: {received[0]:,} characters"
+                        file_version[file_idx] += 1
+                        last_streamed[0] = file_idx
+                    return on_text
+                
+                def convert_uploaded_file(file_idx, f):
+                    # The upload is already in memory; pass its bytes without a temp file
+                    return convert_pdf_to_markdown(
+                        pdf_path=None,
+                        pdf_bytes=f.getvalue(),
+                        api_key=api_key,
+                        prompt=prompt,
+                        base_url=base_url if base_url.strip() else None,
+                        model_name=model,
+                        chunk_size=chunk_size,
+                        max_tokens_per_chunk=max_chunk_tokens or None,
+                        stream=use_stream,
+                        use_chunking=force_chunking,
+                        progress_callback=make_progress_callback(file_idx, file_page_counts[file_idx], f.name),
+                        stream_callback=make_stream_callback(file_idx, f.name),
+                        prompt_cache_name=prompt_cache_name,
+                        max_concurrency=max_concurrency,
+                        controller=controller,
+                        use_text_layer=use_text_layer,
+                        use_cache=use_cache,
+                        allow_partial=False
+                    )
+                
+                def store_results(indices):
+                    # A result already listed (e.g. served again from the session cache) isn't added twice
+                    listed = {(r["name"], r.get("sha256")) for r in st.session_state.converted_results}
+                    new_results = []
+                    for j in indices:
+                        digest = result_digest(outputs[j])
+                        if (uploaded_files[j].name, digest) in listed:
+                            continue
+                        listed.add((uploaded_files[j].name, digest))
+                        new_results.append({
+                            "name": uploaded_files[j].name,
+                            "md": outputs[j],
+                            "sha256": digest,
+                            # Unique across sessions, as the saved results of all sessions are loaded together
+                            "id": uploaded_files[j].name + "_" + uuid.uuid4().hex[:8]
                         })
-                    except Exception as e:
-                        st.error(f"❌ Error converting {f.name}: {str(e)}")
-                    finally:
-                        if os.path.exists(tmp_input_path):
-                            os.unlink(tmp_input_path)
+                    st.session_state.converted_results.extend(new_results)
+                    save_results(new_results)
+                
+                # Files whose result is missing some chunks (kept, but reported as failures)
+                incomplete = set()
+                
+                # Results served from the session cache are stored right away
+                cached = [i for i, output_md in enumerate(outputs) if output_md is not None]
+                if cached:
+                    store_results(cached)
+                
+                try:
+                    with keep_prompt_cache_alive(client, prompt_cache), \
+                            ThreadPoolExecutor(max_workers=max(1, min(parallel_files, len(to_convert)))) as executor:
+                        futures = {executor.submit(convert_uploaded_file, i, uploaded_files[i]): i for i in to_convert}
+                        pending = set(futures)
+                        while pending:
+                            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                i = futures[future]
+                                names = ", ".join(uploaded_files[j].name for j in [i] + copies.get(i, []))
+                                complete = False
+                                try:
+                                    outputs[i] = future.result()
+                                    complete = True
+                                except IncompleteConversionError as e:
+                                    # Keep what did convert, but don't cache it: a rerun retries the failed chunks
+                                    outputs[i] = e.markdown or None
+                                    incomplete.update([i] + copies.get(i, []))
+                                    st.warning(f"⚠️ {names}: {e}; the result is incomplete")
+                                except Exception as e:
+                                    st.error(f"❌ Error converting {names}: {str(e)}")
+                                file_progress[i] = 1.0
+                                for dup in copies.get(i, []):
+                                    outputs[dup] = outputs[i]
+                                    file_progress[dup] = 1.0
+                                if complete and outputs[i]:
+                                    conversion_cache[file_keys[i]] = outputs[i]
+                                    while len(conversion_cache) > SESSION_CACHE_SIZE:
+                                        conversion_cache.popitem(last=False)
+                                # Store each file as soon as it is done, so a rerun keeps the finished ones
+                                if outputs[i] is not None:
+                                    store_results([i] + copies.get(i, []))
+                        
+                            # Overall progress weighted by page count
+                            # Only send updates to the browser when something changed
+                            done_pages = sum(p * n for p, n in zip(file_progress, file_page_counts))
+                            fraction = min(done_pages / total_pages, 1.0)
+                            if fraction != shown_progress:
+                                shown_progress = fraction
+                                progress_bar.progress(fraction)
+                            active = [text for text in file_status if text]
+                            if active and active[-1] != shown_label:
+                                shown_label = active[-1]
+                                status.update(label=shown_label)
+                        
+                            # Live preview: tail of the file that most recently received text
+                            idx = last_streamed[0]
+                            if idx is not None and (idx, file_version[idx]) != shown[0]:
+                                shown[0] = (idx, file_version[idx])
+                                preview.code(file_text[idx], language="markdown")
+                finally:
+                    # Also runs when a rerun interrupts the script, so the server-side cache never leaks
+                    preview.empty()
+                    delete_prompt_cache(client, prompt_cache)
                 
                 progress_bar.progress(1.0)
-                status_text.success(f"✅ Successfully converted {len(uploaded_files)} file(s) ({total_pages} pages)!")
-                st.balloons()
+                # Failed files were reported above; the rest of the batch is kept
+                failed = sum(output_md is None for output_md in outputs)
+                partial = sum(outputs[i] is not None for i in incomplete)
+                if failed or partial:
+                    converted = len(uploaded_files) - failed - partial
+                    label = f"⚠️ Converted {converted} of {len(uploaded_files)} file(s)"
+                    if partial:
+                        label += f", {partial} incomplete"
+                    if failed:
+                        label += f", {failed} failed"
+                    status.update(label=label, state="error")
+                else:
+                    status.update(label=f"✅ Successfully converted {len(uploaded_files)} file(s) ({total_pages} pages)!",
+                                  state="complete")
+                    st.balloons()
 
 with col_output:
     st.subheader("📥 2. Converted Results")
@@ -308,18 +625,16 @@ with col_output:
         # Top action bar
         col_top1, col_top2, col_top3 = st.columns([1, 1, 1])
         
-        # Create ZIP file for batch download
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for result in st.session_state.converted_results:
-                output_filename = result['name'].replace(".pdf", ".md")
-                zip_file.writestr(output_filename, result['md'])
-        zip_buffer.seek(0)
+        # ZIP file for batch download; cached, so reruns don't re-compress everything
+        zip_data = build_zip(tuple(
+            (result['name'].replace(".pdf", ".md"), result['md'])
+            for result in st.session_state.converted_results
+        ))
         
         with col_top1:
             st.download_button(
                 label="📦 Download All (ZIP)",
-                data=zip_buffer,
+                data=zip_data,
                 file_name="converted_files.zip",
                 mime="application/zip",
                 key="dl_all_zip",
@@ -328,6 +643,7 @@ with col_output:
             )
         with col_top3:
             if st.button("🗑️ Clear All", use_container_width=True):
+                remove_results(st.session_state.converted_results)
                 st.session_state.converted_results = []
                 st.rerun()
         